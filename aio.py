@@ -0,0 +1,82 @@
+"""Optional asyncio database access for running independent queries concurrently.
+
+With ``ASYNC_DATABASE_URI`` set (e.g. ``postgresql+asyncpg://postgres@localhost/fyyur``)
+``AsyncDatabase.fetch_all`` sends its SELECT statements through SQLAlchemy's
+asyncio engine, each on its own pooled connection, and waits for all of them
+together. The engine lives on a single event loop in a background thread that
+every request thread shares, so views stay synchronous and the pool is not
+tied to a per-request loop. Without the setting the statements simply run one
+after another on the regular session.
+
+``run_coroutine_threadsafe`` schedules the statements with a copy of the
+caller's context, so the ``Metrics`` listeners attached to the engine count
+them against the request that asked.
+They always go to ``ASYNC_DATABASE_URI``: the replica router only picks
+binds for the regular session.
+"""
+import asyncio
+import threading
+
+from flask import current_app
+
+try:
+    from sqlalchemy.ext.asyncio import create_async_engine
+except ImportError:
+    create_async_engine = None
+
+
+class AsyncDatabase(object):
+
+    def __init__(self, app=None, db=None):
+        self.uri = None
+        self._loop = None
+        self._engine = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('ASYNC_DATABASE_URI', None)
+        app.config.setdefault('ASYNC_POOL_SIZE', 10)
+        app.config.setdefault('ASYNC_MAX_OVERFLOW', 10)
+        self.db = db
+        self.uri = app.config['ASYNC_DATABASE_URI']
+        self.pool_size = app.config['ASYNC_POOL_SIZE']
+        self.max_overflow = app.config['ASYNC_MAX_OVERFLOW']
+        if self.uri and create_async_engine is None:
+            raise RuntimeError('ASYNC_DATABASE_URI needs SQLAlchemy 1.4+ with asyncio support')
+        app.extensions['aio'] = self
+
+    def _start(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='fyyur-aio', daemon=True).start()
+                kwargs = {} if self.uri.startswith('sqlite') else {'pool_size': self.pool_size,
+                                                                   'max_overflow': self.max_overflow}
+                self._engine = create_async_engine(self.uri, **kwargs)
+                metrics = current_app.extensions.get('metrics')
+                if metrics is not None:
+                    metrics.instrument(self._engine.sync_engine)
+                self._loop = loop
+        return self._loop
+
+    async def _fetch(self, statement):
+        async with self._engine.connect() as connection:
+            result = await connection.execute(statement)
+            return result.all()
+
+    async def _gather(self, statements):
+        return await asyncio.gather(*[self._fetch(statement) for statement in statements])
+
+    def fetch_all(self, *statements):
+        """Return the rows of every statement, in order."""
+        if not self.uri:
+            return [self.db.session.execute(statement).all() for statement in statements]
+        return asyncio.run_coroutine_threadsafe(self._gather(statements), self._start()).result()
+
+    def dispose(self):
+        # Forget the loop and engine, e.g. in a freshly forked worker.
+        with self._lock:
+            self._loop = None
+            self._engine = None
@@ -5,26 +5,181 @@
 import json
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort
+from flask import Flask, Blueprint, current_app, render_template, request, Response, flash, redirect, url_for, abort, jsonify, stream_with_context
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_wtf.csrf import CSRFProtect
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.local import LocalProxy
 import logging
 from logging import Formatter, FileHandler
 from forms import ShowForm, VenueForm, ArtistForm
+from search import Search
+from cache import Cache
+from fragments import FragmentCache
+from metrics import Metrics
+from aio import AsyncDatabase
+from routing import ReplicaRouter, RoutingSession, read_only
+from assets import Assets, build as build_assets
+from jobs import JobQueue, task
+from thumbnails import Thumbnails, open_public
+from booking import Bookings, free_slots
+from facets import Facets, register as register_facets
+from calendars import month_bounds, month_weeks, ics_feed
+from streaming import Page, stream_page
+from bulk import FORMATS, guess_format, read_rows, import_rows, export_rows
+import click
+import urllib.request
+import io
 import re
-from datetime import datetime
+import hashlib
+import hmac
+from datetime import date, datetime, timedelta
+from itertools import groupby
+from functools import lru_cache
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
 
-app = Flask(__name__)
-moment = Moment(app)
-app.config.from_object('config')
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
-CSRFProtect(app)
+moment = Moment()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+migrate = Migrate()
+csrf = CSRFProtect()
+
+def extension(name):
+    # The current app's instance of one of our extensions. Each keeps settings,
+    # stores and counters of its own, so create_app builds a fresh one per app.
+    return LocalProxy(lambda: current_app.extensions[name])
+
+aio = extension('aio')
+search = extension('search')
+cache = extension('cache')
+fragments = extension('fragments')
+metrics = extension('metrics')
+replicas = extension('replicas')
+assets = extension('assets')
+jobs = extension('jobs')
+thumbnails = extension('thumbnails')
+bookings = extension('bookings')
+facets = extension('facets')
+# Views, filters, error handlers and CLI commands, registered by create_app.
+main = Blueprint('main', __name__, cli_group=None)
+
+def create_app(config_object='config', **settings):
+    # settings override the config object, e.g. create_app(TESTING=True)
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+    app.config.update(settings)
+    moment.init_app(app)
+    db.init_app(app)
+    migrate.init_app(app, db)
+    csrf.init_app(app)
+    AsyncDatabase(app, db)
+    Search(app)
+    Cache(app)
+    FragmentCache(app)
+    Metrics(app)
+    ReplicaRouter(app)
+    Assets(app)
+    JobQueue(app, db)
+    Thumbnails(app)
+    Bookings(app)
+    Facets(app, db)
+    with app.app_context():
+        for engine in db.engines.values():
+            metrics.instrument(engine)
+        for replica in replicas.replicas:
+            metrics.instrument(replica.engine)
+        metrics.add_collector(cache_metrics)
+        metrics.add_collector(pool_metrics)
+        metrics.add_collector(jobs.collect)
+    app.register_blueprint(main)
+
+    if not app.debug:
+        file_handler = FileHandler('error.log')
+        file_handler.setFormatter(
+            Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
+        )
+        app.logger.setLevel(logging.INFO)
+        file_handler.setLevel(logging.INFO)
+        app.logger.addHandler(file_handler)
+        app.logger.info('errors')
+    return app
+
+def cache_metrics():
+    return [
+        ('cache_hits_total', 'counter', 'Detail page cache hits', cache.hits),
+        ('cache_misses_total', 'counter', 'Detail page cache misses', cache.misses),
+        ('fragment_cache_hits_total', 'counter', 'Template fragment cache hits', fragments.hits),
+        ('fragment_cache_misses_total', 'counter', 'Template fragment cache misses', fragments.misses),
+    ]
+
+def pool_metrics():
+    pool = db.engine.pool
+    if not hasattr(pool, 'checkedout'):
+        return []
+    return [
+        ('db_pool_size', 'gauge', 'Connections kept open by the pool', pool.size()),
+        ('db_pool_checked_out', 'gauge', 'Connections currently in use', pool.checkedout()),
+        ('db_pool_overflow', 'gauge', 'Connections opened beyond the pool size', max(pool.overflow(), 0)),
+    ]
+
+def pool_capacity(pool_size=5, max_overflow=10, **options):
+    # Most connections one QueuePool keeps open; the defaults are SQLAlchemy's.
+    return pool_size + max_overflow
+
+def connection_budget(app, workers):
+    # (per_worker, total) connections every pool can open: each web worker's
+    # primary, replica and async pools, plus one connection per thread of the
+    # `flask run-jobs` process unless the job threads share the web pools.
+    aio, jobs = app.extensions['aio'], app.extensions['jobs']
+    per_worker = pool_capacity(**app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})) \
+        * (1 + len(app.extensions['replicas'].replicas))
+    if aio.uri:
+        per_worker += aio.pool_size + aio.max_overflow
+    job_connections = 0 if jobs.in_process else jobs.workers
+    return per_worker, workers * per_worker + job_connections
+
+def check_database(app, workers=1):
+    # Startup self-check: the database answers, the pools of all workers fit
+    # within its connection limit and the caches are shared between them.
+    # Returns a list of problems, empty when fine.
+    problems = []
+    with app.app_context():
+        engine = db.engine
+        with engine.connect() as connection:
+            connection.execute(db.text('SELECT 1'))
+            max_connections = None
+            if engine.dialect.name == 'postgresql':
+                max_connections = int(connection.execute(db.text('SHOW max_connections')).scalar())
+        per_worker, total = connection_budget(app, workers)
+        app.logger.info('Database reachable; %s workers x %s connections + job workers = %s, '
+                        'server max_connections = %s, pool: %s',
+                        workers, per_worker, total, max_connections, engine.pool.status())
+        if max_connections is not None and total > max_connections:
+            problems.append('{} workers x {} pooled connections + job workers = {} exceeds max_connections={}'
+                            .format(workers, per_worker, total, max_connections))
+        for setting in ('CACHE_TYPE', 'FRAGMENT_CACHE_TYPE'):
+            if workers > 1 and app.config.get(setting) == 'simple':
+                problems.append("{}='simple' is per process and goes stale across {} workers; use 'redis' or 'null'"
+                                .format(setting, workers))
+        engine.dispose()
+    return problems
+
+def check_assets(app):
+    # Startup self-check: with ASSETS_BUNDLED the pages must link the built
+    # bundles, not quietly fall back to the unminified, unhashed sources.
+    if app.config['ASSETS_BUNDLED'] and not app.extensions['assets'].manifest:
+        return ['ASSETS_BUNDLED is set but static/dist/manifest.json is missing; run `flask build-assets`']
+    return []
+
+def check_thumbnails(app):
+    # Thumbnail URLs sit in browser and proxy caches for a year, so every process
+    # must sign them with the same key, before and after a restart.
+    if app.extensions['thumbnails'].enabled and not app.config['THUMBNAIL_SIGNING_KEY']:
+        return ['THUMBNAIL_SIGNING_KEY is not set; signed thumbnail URLs would not survive a restart']
+    return []
 
 def format_phone(value):
     return '-'.join(re.findall(r'\(?(\d{3})\)?[ -]?(\d{3})-?(\d{4})', value)[0])
@@ -36,10 +191,16 @@ def format_phone(value):
 
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (
+        db.Index('ix_Venue_city_state', 'city', 'state', 'id'),
+        db.Index('ix_Venue_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_Venue_genres', 'genres', postgresql_using='gin'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
-    genres = db.Column(db.ARRAY(db.String(120)))
+    # a JSON array on SQLite, where the tests can run without PostgreSQL
+    genres = db.Column(db.ARRAY(db.String(120)).with_variant(db.JSON, 'sqlite'))
     city = db.Column(db.String(120), nullable=False)
     state = db.Column(db.String(120), nullable=False)
     address = db.Column(db.String(120), nullable=False)
@@ -49,15 +210,28 @@ class Venue(db.Model):
     facebook_link = db.Column(db.String(120))
     seeking_talent = db.Column(db.Boolean)
     seeking_description = db.Column(db.String(500))
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow,
+                           server_default=db.func.now(), index=True)
+    # maintained by record_show / refresh_show_counters
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    next_show_time = db.Column(db.DateTime, index=True)
     show = db.relationship('Show', backref='venue', cascade='all, delete-orphan')
+    # bumped by every ORM update, which is guarded by WHERE version = <loaded version>
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+    __mapper_args__ = {'version_id_col': version}
 
 
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (
+        db.Index('ix_Artist_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_Artist_genres', 'genres', postgresql_using='gin'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
-    genres = db.Column(db.ARRAY(db.String(120)))
+    genres = db.Column(db.ARRAY(db.String(120)).with_variant(db.JSON, 'sqlite'))
     city = db.Column(db.String(120), nullable=False)
     state = db.Column(db.String(120), nullable=False)
     phone = db.Column(db.String(120), nullable=False)
@@ -66,37 +240,436 @@ class Artist(db.Model):
     facebook_link = db.Column(db.String(120))
     seeking_venue = db.Column(db.Boolean)
     seeking_description = db.Column(db.String(500))
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow,
+                           server_default=db.func.now(), index=True)
+    # maintained by record_show / refresh_show_counters
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    next_show_time = db.Column(db.DateTime, index=True)
     show = db.relationship('Show', backref='artist', cascade='all, delete-orphan')
+    # bumped by every ORM update, which is guarded by WHERE version = <loaded version>
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+    __mapper_args__ = {'version_id_col': version}
 
 
 class Show(db.Model):
     __tablename__ = 'Show'
+    __table_args__ = (
+        db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_Show_start_time', 'start_time'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
     artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
     start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False, default=lambda context: show_end_time(
+        context.get_current_parameters()['start_time']))
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow,
+                           server_default=db.func.now(), index=True)
+
+def show_end_time(start_time):
+    return start_time + timedelta(minutes=current_app.config['SHOW_DURATION_MINUTES'])
+
+register_facets(Venue, state=Venue.state, city=Venue.city, genre=Venue.genres, seeking=Venue.seeking_talent)
+register_facets(Artist, state=Artist.state, city=Artist.city, genre=Artist.genres, seeking=Artist.seeking_venue)
+
+
+# The name search indexes need pg_trgm when the tables are created outside of migrations
+for table in (Venue.__table__, Artist.__table__):
+    db.event.listen(table, 'before_create',
+                    db.DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
+# A venue or artist can't hold two shows at once; the exclusion constraints need
+# btree_gist for the equality part.
+db.event.listen(Show.__table__, 'before_create',
+                db.DDL('CREATE EXTENSION IF NOT EXISTS btree_gist').execute_if(dialect='postgresql'))
+for key in ('venue', 'artist'):
+    db.event.listen(Show.__table__, 'after_create', db.DDL(
+        'ALTER TABLE "Show" ADD CONSTRAINT "ex_Show_{0}_slot" '
+        'EXCLUDE USING gist ({0}_id WITH =, tsrange(start_time, end_time) WITH &&)'.format(key)
+    ).execute_if(dialect='postgresql'))
+
+
+#----------------------------------------------------------------------------#
+# Queries.
+#----------------------------------------------------------------------------#
+
+def record_show(show):
+    # Bump the denormalised counters of the show's venue and artist inside the
+    # current transaction.
+    upcoming = show.start_time >= datetime.now()
+    for model, id in ((Venue, show.venue_id), (Artist, show.artist_id)):
+        values = {model.shows_count: model.shows_count + 1}
+        if upcoming:
+            values[model.upcoming_shows_count] = model.upcoming_shows_count + 1
+            values[model.next_show_time] = db.case(
+                (db.or_(model.next_show_time.is_(None), model.next_show_time > show.start_time), show.start_time),
+                else_=model.next_show_time)
+        model.query.filter(model.id==id).update(values, synchronize_session=False)
+
+def refresh_show_counters(model, key, *criteria):
+    # Recompute the counters of the model rows matching criteria from Show;
+    # key is Show.venue_id or Show.artist_id.
+    now = datetime.now()
+    shows = db.session.query(Show.id).filter(key==model.id)
+    model.query.filter(*criteria).update({
+        model.shows_count: shows.with_entities(db.func.count(Show.id)).scalar_subquery(),
+        model.upcoming_shows_count: shows.with_entities(db.func.count(Show.id))
+            .filter(Show.start_time>=now).scalar_subquery(),
+        model.next_show_time: shows.with_entities(db.func.min(Show.start_time))
+            .filter(Show.start_time>=now).scalar_subquery(),
+    }, synchronize_session=False)
+
+def rollover_shows():
+    # Shows that have started since the last run move from upcoming to past.
+    now = datetime.now()
+    refresh_show_counters(Venue, Show.venue_id, Venue.next_show_time<now)
+    refresh_show_counters(Artist, Show.artist_id, Artist.next_show_time<now)
+    db.session.commit()
+
+def venue_detail(venue_id):
+    venue = Venue.query.get(venue_id)
+    if venue is None:
+        return None
+    d = {col: getattr(venue, col) for col in Venue.__table__.columns.keys()}
+    shows = Show.query.with_entities(Show.artist_id, Show.start_time, Artist.name.label('artist_name'),
+                                     Artist.image_link.label('artist_image_link')) \
+        .join(Artist, Show.artist_id==Artist.id).filter(Show.venue_id==venue_id)
+
+    def get_show_info(show):
+        return {'artist_id': show.artist_id, 'start_time': show.start_time,
+                'artist_name': show.artist_name, 'artist_image_link': show.artist_image_link}
+
+    now = datetime.now()
+    past, upcoming = aio.fetch_all(shows.filter(Show.start_time<now).order_by(Show.start_time.desc()).statement,
+                                   shows.filter(Show.start_time>=now).order_by(Show.start_time).statement)
+    d['past_shows'] = [get_show_info(show) for show in past]
+    d['upcoming_shows'] = [get_show_info(show) for show in upcoming]
+    d['past_shows_count'] = len(d['past_shows'])
+    d['upcoming_shows_count'] = len(d['upcoming_shows'])
+    return d
+
+def artist_detail(artist_id):
+    artist = Artist.query.get(artist_id)
+    if artist is None:
+        return None
+    d = {col: getattr(artist, col) for col in Artist.__table__.columns.keys()}
+    shows = Show.query.with_entities(Show.venue_id, Show.start_time, Venue.name.label('venue_name'),
+                                     Venue.image_link.label('venue_image_link')) \
+        .join(Venue, Show.venue_id==Venue.id).filter(Show.artist_id==artist_id)
+
+    def get_show_info(show):
+        return {'venue_id': show.venue_id, 'start_time': show.start_time,
+                'venue_name': show.venue_name, 'venue_image_link': show.venue_image_link}
+
+    now = datetime.now()
+    past, upcoming = aio.fetch_all(shows.filter(Show.start_time<now).order_by(Show.start_time.desc()).statement,
+                                   shows.filter(Show.start_time>=now).order_by(Show.start_time).statement)
+    d['past_shows'] = [get_show_info(show) for show in past]
+    d['upcoming_shows'] = [get_show_info(show) for show in upcoming]
+    d['past_shows_count'] = len(d['past_shows'])
+    d['upcoming_shows_count'] = len(d['upcoming_shows'])
+    return d
+
+def venue_rows(after, limit, *criteria):
+    # Venues in (city, state, id) order; after is the id of the last venue on the
+    # previous page. Raises ValueError when that venue no longer exists.
+    query = Venue.query.with_entities(Venue.city, Venue.state, Venue.id, Venue.name, Venue.upcoming_shows_count) \
+        .filter(*criteria)
+    if after is not None:
+        cursor = Venue.query.with_entities(Venue.city, Venue.state, Venue.id).filter(Venue.id==after).first()
+        if cursor is None:
+            raise ValueError('unknown venue {}'.format(after))
+        query = query.filter(db.tuple_(Venue.city, Venue.state, Venue.id) > tuple(cursor))
+    return Page(query.order_by(Venue.city, Venue.state, Venue.id), limit)
+
+def group_areas(rows):
+    for (city, state), area_venues in groupby(rows, key=lambda row: (row.city, row.state)):
+        d = {'city': city, 'state': state, 'venues': []}
+        for venue in area_venues:
+            d['venues'].append({'id': venue.id, 'name': venue.name, 'num_upcoming_shows': venue.upcoming_shows_count})
+        yield d
+
+def venue_areas(after, limit):
+    page = venue_rows(after, limit)
+    areas = list(group_areas(page.all()))
+    return areas, page.next
+
+def artist_rows(after, limit, *criteria):
+    query = Artist.query.with_entities(Artist.id, Artist.name).filter(*criteria)
+    if after is not None:
+        query = query.filter(Artist.id > after)
+    return Page(query.order_by(Artist.id), limit)
+
+def artist_page(after, limit):
+    page = artist_rows(after, limit)
+    artists = page.all()
+    return artists, page.next
+
+def search_results(model, search_term, after=None, limit=None, criteria=()):
+    limit = limit or search.limit
+    matches = search(model, search_term, after, limit + 1, criteria)
+    next_after = matches[limit - 1][0] if len(matches) > limit else None
+    matches = matches[:limit]
+    counts = dict(model.query.with_entities(model.id, model.upcoming_shows_count)
+                  .filter(model.id.in_([id for id, _ in matches])).all()) if matches else {}
+    data = [{'id': id, 'name': name, 'num_upcoming_shows': counts.get(id, 0)} for id, name in matches]
+    count, exact = search.count(model, search_term, criteria)
+    return {'count': count, 'count_exact': exact, 'data': data, 'next': next_after}
+
+def table_count(model):
+    # Returns (count, exact). Past EXACT_COUNT_THRESHOLD rows the planner's
+    # estimate in pg_class.reltuples, kept fresh by autovacuum, replaces count(*).
+    if db.engine.dialect.name == 'postgresql':
+        estimate = db.session.execute(db.text('SELECT reltuples FROM pg_class WHERE oid = CAST(:name AS regclass)'),
+                                      {'name': '"{}"'.format(model.__tablename__)}).scalar()
+        if estimate is not None and estimate > current_app.config['EXACT_COUNT_THRESHOLD']:
+            return int(estimate), False
+    return db.session.query(db.func.count(model.id)).scalar(), True
+
+def listing_total(model, selected):
+    # (count, exact) of the rows matching the selected facets. A single facet's
+    # count is in the Facet table; combinations are counted up to SEARCH_COUNT_LIMIT.
+    if not selected:
+        return table_count(model)
+    if len(selected) == 1:
+        (facet, value), = selected.items()
+        return facets.count(model, facet, value), True
+    matches = model.query.with_entities(model.id).filter(*facets.criteria(model, selected)) \
+        .limit(search.count_limit).subquery()
+    count = db.session.query(db.func.count()).select_from(matches).scalar()
+    return count, count < search.count_limit
+
+def show_row(show):
+    d = {'id': show.id, 'venue_id': show.venue_id, 'artist_id': show.artist_id, 'start_time': show.start_time}
+    d['venue_name'] = show.venue_name
+    d['artist_name'] = show.artist_name
+    d['artist_image_link'] = show.artist_image_link
+    return d
+
+def show_tile(show):
+    # show_row plus the venue and artist versions, which the cached tile is
+    # keyed on: every edit of either bumps them.
+    d = show_row(show)
+    d['venue_version'] = show.venue_version
+    d['artist_version'] = show.artist_version
+    return d
+
+def show_rows(after, per_page, start=None, end=None, row=show_row):
+    # after is the keyset cursor "<start_time isoformat>,<show id>" of the last row on the
+    # previous page; raises ValueError when it is malformed. start/end limit the
+    # listing to a range of start_time.
+    query = Show.query.with_entities(Show.id, Show.venue_id, Show.artist_id, Show.start_time,
+                                     Venue.name.label('venue_name'), Artist.name.label('artist_name'),
+                                     Artist.image_link.label('artist_image_link'),
+                                     Venue.version.label('venue_version'), Artist.version.label('artist_version')) \
+        .join(Venue, Show.venue_id==Venue.id).join(Artist, Show.artist_id==Artist.id)
+    if start is not None:
+        query = query.filter(Show.start_time>=start)
+    if end is not None:
+        query = query.filter(Show.start_time<end)
+    if after:
+        start_time, show_id = after.rsplit(',', 1)
+        query = query.filter(db.tuple_(Show.start_time, Show.id) > (datetime.fromisoformat(start_time), int(show_id)))
+    return Page(query.order_by(Show.start_time, Show.id), per_page, row,
+                lambda last: '{},{}'.format(last.start_time.isoformat(), last.id))
+
+def show_page(after, per_page, start=None, end=None):
+    page = show_rows(after, per_page, start, end)
+    shows = page.all()
+    return shows, page.next
+
+def shows_between(start, end, *criteria):
+    # Range scan on start_time, or on (venue_id|artist_id, start_time) with criteria.
+    return Show.query.with_entities(Show.id, Show.venue_id, Show.artist_id, Show.start_time, Show.end_time,
+                                    Venue.name.label('venue_name'), Venue.address, Venue.city, Venue.state,
+                                    Artist.name.label('artist_name')) \
+        .join(Venue, Show.venue_id==Venue.id).join(Artist, Show.artist_id==Artist.id) \
+        .filter(Show.start_time>=start, Show.start_time<end, *criteria) \
+        .order_by(Show.start_time, Show.id).all()
+
+def daily_show_counts(start, end, *criteria):
+    # {date: number of shows starting that day} in [start, end), grouped in SQL.
+    day = db.func.date(Show.start_time)
+    rows = db.session.query(day, db.func.count(Show.id)) \
+        .filter(Show.start_time>=start, Show.start_time<end, *criteria).group_by(day).all()
+    return {date.fromisoformat(str(day)[:10]): count for day, count in rows}
+
+def booking_conflict(venue_id, artist_id, start_time, end_time):
+    # Message describing the first booking that overlaps the slot, or None.
+    for label, column, key in (('Venue', Show.venue_id, venue_id), ('Artist', Show.artist_id, artist_id)):
+        booked = bookings.overlapping(column, key, start_time, end_time)
+        if booked:
+            _, booked_start, booked_end = booked[0]
+            return '{} {} is already booked from {:%Y-%m-%d %H:%M} to {:%Y-%m-%d %H:%M}.'.format(
+                label, key, booked_start, booked_end)
+    return None
+
+def availability(column, key, start, end):
+    booked = bookings.overlapping(column, key, start, end)
+    return {
+        'from': start,
+        'to': end,
+        'booked': [{'show_id': id, 'start_time': booked_start, 'end_time': booked_end}
+                   for id, booked_start, booked_end in booked],
+        'free': [{'start_time': free_start, 'end_time': free_end}
+                 for free_start, free_end in free_slots(booked, start, end)],
+    }
+
+# Version columns for ETags: row count and newest updated_at of the matching rows,
+# plus how many of the matching shows have started, since that moves shows from
+# upcoming to past without any write. The criteria must narrow the rows down to
+# an index range (one venue, one artist): this runs before every 304.
+def row_version(model, *criteria):
+    return [db.session.query(db.func.count(model.id)).filter(*criteria).scalar_subquery(),
+            db.session.query(db.func.max(model.updated_at)).filter(*criteria).scalar_subquery()]
+
+def started_shows(*criteria):
+    return db.session.query(db.func.count(Show.id)).filter(Show.start_time<datetime.now(), *criteria).scalar_subquery()
+
+def etag_of(*values, **params):
+    return hashlib.sha1(repr((values, sorted(params.items()))).encode('utf-8')).hexdigest()
+
+def resource_etag(*columns, **params):
+    return etag_of(tuple(db.session.query(*columns).one()), **params)
+
+def page_etag(page, *columns, **params):
+    # A listing page's version is the id and updated_at of its own rows, and of
+    # the first row of the next page: the same keyset scan as the page itself,
+    # without the other columns.
+    rows = page.query.with_entities(*columns).limit(page.limit + 1).all()
+    return etag_of([tuple(row) for row in rows], **params)
+
+# Detail pages embed the other side's name and image, so a venue edit also
+# invalidates every artist that played there and vice versa.
+def venue_cache_keys(venue_id):
+    artist_ids = Show.query.with_entities(Show.artist_id).filter_by(venue_id=venue_id).distinct().all()
+    return ['venue:{}'.format(venue_id)] + ['artist:{}'.format(id) for id, in artist_ids]
+
+def artist_cache_keys(artist_id):
+    venue_ids = Show.query.with_entities(Show.venue_id).filter_by(artist_id=artist_id).distinct().all()
+    return ['artist:{}'.format(artist_id)] + ['venue:{}'.format(id) for id, in venue_ids]
+
+def changed_columns(row, form, **values):
+    # The submitted column values (form data, overridden by values) that differ
+    # from what row holds, so an edit only writes what it changes. A NULL column
+    # matches an empty field: the form posts '', False or [] for it.
+    columns = row.__table__.columns.keys()
+    submitted = {key: value for key, value in form.data.items() if key in columns and key not in ('id', 'version')}
+    submitted.update(values)
+    return {key: value for key, value in submitted.items()
+            if getattr(row, key) != value and not (getattr(row, key) is None and value in ('', False, []))}
+
+
+#----------------------------------------------------------------------------#
+# Background jobs.
+#----------------------------------------------------------------------------#
+
+LINK_COLUMNS = ('image_link', 'website', 'facebook_link')
+
+def link_ok(url, image=False):
+    req = urllib.request.Request(url, method='HEAD', headers={'User-Agent': 'fyyur-link-check'})
+    try:
+        with open_public(req, current_app.config['LINK_CHECK_TIMEOUT']) as response:
+            return not image or response.headers.get_content_maintype() == 'image'
+    except (OSError, ValueError):
+        return False
+
+@task
+def check_links(kind, id):
+    # Log links on a new or edited venue/artist that no longer resolve, without
+    # making the request wait on remote hosts.
+    model = {'venue': Venue, 'artist': Artist}[kind]
+    row = model.query.get(id)
+    if row is None:
+        return
+    for column in LINK_COLUMNS:
+        url = getattr(row, column)
+        if url and not link_ok(url, image=column == 'image_link'):
+            current_app.logger.warning('%s %s has a broken %s: %s', kind.capitalize(), id, column, url)
 
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
+DATETIME_FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma",
+}
+
+@lru_cache(maxsize=None)
+def datetime_pattern(format):
+    return babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format))
+
+@lru_cache(maxsize=None)
+def datetime_locale():
+    return babel.Locale.parse(babel.dates.LC_TIME or 'en_US_POSIX')
+
+# Views pass datetime objects; strings are still accepted for older callers.
+# Show tiles repeat the same few thousand start times, so results are memoised.
+@lru_cache(maxsize=8192)
 def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
+  if isinstance(value, str):
+      value = dateutil.parser.parse(value)
+  return datetime_pattern(format).apply(value, datetime_locale())
 
-app.jinja_env.filters['datetime'] = format_datetime
+main.add_app_template_filter(format_datetime, 'datetime')
 
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
-@app.route('/')
+def date_arg(name):
+    # ISO date or datetime from the query string, None when absent. Values with
+    # a UTC offset are converted to naive server-local time, like the stored
+    # times (start_time is entered and compared against datetime.now()).
+    value = request.args.get(name)
+    try:
+        value = datetime.fromisoformat(value) if value else None
+    except ValueError:
+        abort(400)
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value
+
+def month_arg():
+    try:
+        return month_bounds(request.args.get('month'))
+    except ValueError:
+        abort(400)
+
+def limit_arg(default):
+    # ?limit=<n>, clamped to MAX_PAGE_SIZE, or STREAM_MAX_PAGE_SIZE when the
+    # listings are streamed.
+    try:
+        limit = int(request.args.get('limit') or default)
+    except ValueError:
+        abort(400)
+    maximum = current_app.config['STREAM_MAX_PAGE_SIZE' if current_app.config['STREAM_LISTINGS'] else 'MAX_PAGE_SIZE']
+    return max(1, min(limit, maximum))
+
+def page_args(default):
+    # ?after=<id>&limit=<n> for the keyset-paginated listings.
+    try:
+        after = request.args.get('after')
+        after = int(after) if after else None
+    except ValueError:
+        abort(400)
+    return after, limit_arg(default)
+
+def listing_rows(page):
+    # Rows straight off the cursor when streaming, otherwise fetched up front.
+    return page if current_app.config['STREAM_LISTINGS'] else page.all()
+
+def render_listing(template_name, **context):
+    if current_app.config['STREAM_LISTINGS']:
+        return stream_page(template_name, **context)
+    return render_template(template_name, **context)
+
+@main.route('/')
 def index():
   return render_template('pages/home.html')
 
@@ -104,61 +677,44 @@ def index():
 #  Venues
 #  ----------------------------------------------------------------
 
-@app.route('/venues')
+@main.route('/venues')
 def venues():
-    areas = []
-    for city, state in Venue.query.with_entities(Venue.city, Venue.state).distinct().all():
-        d = {'city': city, 'state': state, 'venues': []}
-        for venue in Venue.query.with_entities(Venue.id, Venue.name).filter_by(city=city, state=state).order_by(Venue.id).all():
-            dv = {'id': venue.id, 'name': venue.name}
-            dv['num_upcoming_shows'] = len(Show.query.filter_by(venue_id=venue.id).filter(Show.start_time>=datetime.now()).all())
-            d['venues'].append(dv)
-        areas.append(d)
-    return render_template('pages/venues.html', areas=areas)
-
-@app.route('/venues/search', methods=['POST'])
+    after, limit = page_args(current_app.config['PAGE_SIZE'])
+    selected = facets.selected(Venue, request.args)
+    try:
+        page = venue_rows(after, limit, *facets.criteria(Venue, selected))
+    except ValueError:
+        abort(400)
+    total, total_exact = listing_total(Venue, selected)
+    return render_listing('pages/venues.html', areas=group_areas(listing_rows(page)), page=page,
+                          total=total, total_exact=total_exact, selected=selected, facet_counts=facets.counts(Venue))
+
+@main.route('/venues/search', methods=['GET', 'POST'])
+@read_only
 def search_venues():
-    search_term = request.form.get('search_term', '')
-    response = {'data': []}
-    for venue in Venue.query.with_entities(Venue.id, Venue.name).filter(Venue.name.like('%{}%'.format(search_term))).all():
-        d = {'id': venue.id, 'name': venue.name}
-        d['num_upcoming_shows'] = len(Show.query.filter_by(venue_id=venue.id).filter(Show.start_time>=datetime.now()).all())
-        response['data'].append(d)
-    response['count'] = len(response['data'])
-    return render_template('pages/search_venues.html', results=response, search_term=search_term)
-
-@app.route('/venues/<int:venue_id>')
+    search_term = request.values.get('search_term', '')
+    after, limit = page_args(current_app.config['SEARCH_RESULT_LIMIT'])
+    selected = facets.selected(Venue, request.values)
+    response = search_results(Venue, search_term, after, limit, facets.criteria(Venue, selected))
+    return render_template('pages/search_venues.html', results=response, search_term=search_term,
+                           selected=selected, facet_counts=facets.counts(Venue))
+
+@main.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
-    venue = Venue.query.get(venue_id)
+    venue = cache.get_or_set('venue:{}'.format(venue_id), lambda: venue_detail(venue_id))
     if venue is None:
         abort(404)
-    shows = Show.query.filter_by(venue_id=venue_id)
-
-    def get_show_info(show):
-        d = {'artist_id': show.artist_id, 'start_time': str(show.start_time)}
-        artist = show.artist
-        d['artist_name'] = artist.name
-        d['artist_image_link'] = artist.image_link
-        return d
-
-    venue.past_shows, venue.upcoming_shows = [], []
-    for show in shows.filter(Show.start_time<datetime.now()).order_by(Show.start_time.desc()).all():
-        venue.past_shows.append(get_show_info(show))
-    for show in shows.filter(Show.start_time>=datetime.now()).order_by(Show.start_time).all():
-        venue.upcoming_shows.append(get_show_info(show))
-    venue.past_shows_count = len(venue.past_shows)
-    venue.upcoming_shows_count = len(venue.upcoming_shows)
     return render_template('pages/show_venue.html', venue=venue)
 
 #  Create Venue
 #  ----------------------------------------------------------------
 
-@app.route('/venues/create', methods=['GET'])
+@main.route('/venues/create', methods=['GET'])
 def create_venue_form():
   form = VenueForm()
   return render_template('forms/new_venue.html', form=form)
 
-@app.route('/venues/create', methods=['POST'])
+@main.route('/venues/create', methods=['POST'])
 def create_venue_submission():
     venue = Venue()
     form = VenueForm()
@@ -173,7 +729,11 @@ def create_venue_submission():
             db.session.add(venue)
             db.session.flush()
             venue_id = venue.id
+            facets.add(Venue, venue)
+            jobs.enqueue('check_links', kind='venue', id=venue_id)
             db.session.commit()
+            search.invalidate(Venue)
+            fragments.invalidate('venues')
         except:
             error = True
             db.session.rollback()
@@ -181,13 +741,13 @@ def create_venue_submission():
             db.session.close()
         if error:
             flash('An error occurred. Venue ' + venue.name + ' could not be listed.')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         else:
             flash('Venue ' + request.form['name'] + ' was successfully listed!')
-            return redirect(url_for('show_venue', venue_id=venue_id))
+            return redirect(url_for('main.show_venue', venue_id=venue_id))
 
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
+@main.route('/venues/<venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
     venue = Venue.query.get(venue_id)
     if venue is None:
@@ -195,8 +755,18 @@ def delete_venue(venue_id):
     name = venue.name
     error = False
     try:
+        cache_keys = venue_cache_keys(venue.id)
+        artist_ids = [id for id, in Show.query.with_entities(Show.artist_id).filter_by(venue_id=venue.id).distinct()]
+        facets.remove(Venue, venue)
         db.session.delete(venue)
+        db.session.flush()
+        if artist_ids:
+            refresh_show_counters(Artist, Show.artist_id, Artist.id.in_(artist_ids))
         db.session.commit()
+        search.invalidate(Venue)
+        bookings.invalidate()
+        cache.delete(*cache_keys)
+        fragments.invalidate('venues', *cache_keys)
     except:
         error = True
         db.session.rollback()
@@ -204,64 +774,51 @@ def delete_venue(venue_id):
         db.session.close()
     if error:
         flash('An error occurred. Venue ' + name + ' could not be deleted.')
-        return redirect(url_for('show_venue', venue_id=venue_id))
+        return redirect(url_for('main.show_venue', venue_id=venue_id))
     else:
         flash('Venue ' + name + ' was successfully deleted!')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
 
   # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
   # clicking that button delete it from the db then redirect the user to the homepage
 
 #  Artists
 #  ----------------------------------------------------------------
-@app.route('/artists')
+@main.route('/artists')
 def artists():
-    artists = Artist.query.with_entities(Artist.id, Artist.name).order_by(Artist.id).all()
-    return render_template('pages/artists.html', artists=artists)
+    after, limit = page_args(current_app.config['PAGE_SIZE'])
+    selected = facets.selected(Artist, request.args)
+    page = artist_rows(after, limit, *facets.criteria(Artist, selected))
+    total, total_exact = listing_total(Artist, selected)
+    return render_listing('pages/artists.html', artists=listing_rows(page), page=page,
+                          total=total, total_exact=total_exact, selected=selected, facet_counts=facets.counts(Artist))
 
-@app.route('/artists/search', methods=['POST'])
+@main.route('/artists/search', methods=['GET', 'POST'])
+@read_only
 def search_artists():
-    search_term = request.form.get('search_term', '')
-    response = {'data': []}
-    for artist in Artist.query.with_entities(Artist.id, Artist.name).filter(Artist.name.like('%{}%'.format(search_term))).all():
-        d = {'id': artist.id, 'name': artist.name}
-        d['num_upcoming_shows'] = len(Show.query.filter_by(artist_id=artist.id).filter(Show.start_time>=datetime.now()).all())
-        response['data'].append(d)
-    response['count'] = len(response['data'])
-    return render_template('pages/search_artists.html', results=response, search_term=search_term)
-
-@app.route('/artists/<int:artist_id>')
+    search_term = request.values.get('search_term', '')
+    after, limit = page_args(current_app.config['SEARCH_RESULT_LIMIT'])
+    selected = facets.selected(Artist, request.values)
+    response = search_results(Artist, search_term, after, limit, facets.criteria(Artist, selected))
+    return render_template('pages/search_artists.html', results=response, search_term=search_term,
+                           selected=selected, facet_counts=facets.counts(Artist))
+
+@main.route('/artists/<int:artist_id>')
 def show_artist(artist_id):
-    artist = Artist.query.get(artist_id)
+    artist = cache.get_or_set('artist:{}'.format(artist_id), lambda: artist_detail(artist_id))
     if artist is None:
         abort(404)
-    shows = Show.query.filter_by(artist_id=artist_id)
-
-    def get_show_info(show):
-        d = {'venue_id': show.venue_id, 'start_time': str(show.start_time)}
-        venue = show.venue
-        d['venue_name'] = venue.name
-        d['venue_image_link'] = venue.image_link
-        return d
-
-    artist.past_shows, artist.upcoming_shows = [], []
-    for show in shows.filter(Show.start_time<datetime.now()).order_by(Show.start_time.desc()).all():
-        artist.past_shows.append(get_show_info(show))
-    for show in shows.filter(Show.start_time>=datetime.now()).order_by(Show.start_time).all():
-        artist.upcoming_shows.append(get_show_info(show))
-    artist.past_shows_count = len(artist.past_shows)
-    artist.upcoming_shows_count = len(artist.upcoming_shows)
     return render_template('pages/show_artist.html', artist=artist)
 
 #  Create Artist
 #  ----------------------------------------------------------------
 
-@app.route('/artists/create', methods=['GET'])
+@main.route('/artists/create', methods=['GET'])
 def create_artist_form():
   form = ArtistForm()
   return render_template('forms/new_artist.html', form=form)
 
-@app.route('/artists/create', methods=['POST'])
+@main.route('/artists/create', methods=['POST'])
 def create_artist_submission():
     artist = Artist()
     form = ArtistForm()
@@ -276,7 +833,10 @@ def create_artist_submission():
             db.session.add(artist)
             db.session.flush()
             artist_id = artist.id
+            facets.add(Artist, artist)
+            jobs.enqueue('check_links', kind='artist', id=artist_id)
             db.session.commit()
+            search.invalidate(Artist)
         except:
             error = True
             db.session.rollback()
@@ -284,14 +844,25 @@ def create_artist_submission():
             db.session.close()
         if error:
             flash('An error occurred. Artist ' + artist.name + ' could not be listed.')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         else:
             flash('Artist ' + request.form['name'] + ' was successfully listed!')
-            return redirect(url_for('show_artist', artist_id=artist_id))
+            return redirect(url_for('main.show_artist', artist_id=artist_id))
 
 #  Update
 #  ----------------------------------------------------------------
-@app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+def edit_conflict(model, id, form):
+    # The row was saved by someone else since the form was loaded. The submitted
+    # values come back against the current version, so saving again overwrites.
+    row = model.query.get(id)
+    if row is None:
+        abort(404)
+    kind = model.__name__.lower()
+    flash('{} {} was changed by someone else while you were editing it. '
+          'Saving again will overwrite their changes.'.format(model.__name__, row.name))
+    return render_template('forms/edit_{}.html'.format(kind), form=form, **{kind: row}), 409
+
+@main.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
     artist = Artist.query.get(artist_id)
     if artist is None:
@@ -299,40 +870,59 @@ def edit_artist(artist_id):
     form = ArtistForm(obj=artist)
     return render_template('forms/edit_artist.html', form=form, artist=artist)
 
-@app.route('/artists/<int:artist_id>/edit', methods=['POST'])
+@main.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
     artist = Artist.query.get(artist_id)
-    if Artist is None:
+    if artist is None:
         abort(404)
-    name = Artist.name
+    version = request.form.get('version', type=int)
+    if version is None:
+        # without the version the form was loaded at, a stale edit would
+        # silently overwrite someone else's changes
+        abort(400)
+    name = artist.name
     form = ArtistForm()
     if not form.validate_on_submit():
         flash('Invalid value found in ' + ', '.join(form.errors.keys()) + ' field(s).')
         return render_template('forms/edit_artist.html', form=form, artist=artist)
+    elif version != artist.version:
+        return edit_conflict(Artist, artist_id, form)
     else:
-        error = False
+        error = conflict = False
         try:
-            edited = Artist()
-            form.populate_obj(edited)
-            for col in Artist.__table__.columns.keys():
-                if col != 'id':
-                    setattr(artist, col, getattr(edited, col))
+            cache_keys = artist_cache_keys(artist_id)
+            before = facets.values(Artist, artist)
+            changes = changed_columns(artist, form, phone=format_phone(form.phone.data))
+            for column, value in changes.items():
+                setattr(artist, column, value)
             name = artist.name
-            artist.phone = format_phone(artist.phone)
+            if changes:
+                facets.apply(Artist, before, facets.values(Artist, artist))
+            if changes.keys() & LINK_COLUMNS:
+                jobs.enqueue('check_links', kind='artist', id=artist_id)
             db.session.commit()
+            if changes:
+                search.invalidate(Artist)
+                cache.delete(*cache_keys)
+                fragments.invalidate(*cache_keys)
+        except StaleDataError:
+            conflict = True
+            db.session.rollback()
         except:
             error = True
             db.session.rollback()
         finally:
             db.session.close()
+        if conflict:
+            return edit_conflict(Artist, artist_id, form)
         if error:
             flash('An error occurred. Artist ' + name + ' could not be updated.')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         else:
             flash('Artist ' + name + ' was successfully updated!')
-            return redirect(url_for('show_artist', artist_id=artist_id))
+            return redirect(url_for('main.show_artist', artist_id=artist_id))
 
-@app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@main.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
     venue = Venue.query.get(venue_id)
     if venue is None:
@@ -340,74 +930,171 @@ def edit_venue(venue_id):
     form = VenueForm(obj=venue)
     return render_template('forms/edit_venue.html', form=form, venue=venue)
 
-@app.route('/venues/<int:venue_id>/edit', methods=['POST'])
+@main.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
     venue = Venue.query.get(venue_id)
     if venue is None:
         abort(404)
+    version = request.form.get('version', type=int)
+    if version is None:
+        # without the version the form was loaded at, a stale edit would
+        # silently overwrite someone else's changes
+        abort(400)
     name = venue.name
     form = VenueForm()
     if not form.validate_on_submit():
         flash('Invalid value found in ' + ', '.join(form.errors.keys()) + ' field(s).')
         return render_template('forms/edit_venue.html', form=form, venue=venue)
+    elif version != venue.version:
+        return edit_conflict(Venue, venue_id, form)
     else:
-        error = False
+        error = conflict = False
         try:
-            edited = Venue()
-            form.populate_obj(edited)
-            for col in Venue.__table__.columns.keys():
-                if col != 'id':
-                    setattr(venue, col, getattr(edited, col))
+            cache_keys = venue_cache_keys(venue_id)
+            before = facets.values(Venue, venue)
+            changes = changed_columns(venue, form, phone=format_phone(form.phone.data))
+            for column, value in changes.items():
+                setattr(venue, column, value)
             name = venue.name
-            venue.phone = format_phone(venue.phone)
+            if changes:
+                facets.apply(Venue, before, facets.values(Venue, venue))
+            if changes.keys() & LINK_COLUMNS:
+                jobs.enqueue('check_links', kind='venue', id=venue_id)
             db.session.commit()
+            if changes:
+                search.invalidate(Venue)
+                cache.delete(*cache_keys)
+                fragments.invalidate('venues', *cache_keys)
+        except StaleDataError:
+            conflict = True
+            db.session.rollback()
         except:
             error = True
             db.session.rollback()
         finally:
             db.session.close()
+        if conflict:
+            return edit_conflict(Venue, venue_id, form)
         if error:
             flash('An error occurred. Venue ' + name + ' could not be updated.')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         else:
             flash('Venue ' + name + ' was successfully updated!')
-            return redirect(url_for('show_venue', venue_id=venue_id))
+            return redirect(url_for('main.show_venue', venue_id=venue_id))
 
 #  Shows
 #  ----------------------------------------------------------------
 
-@app.route('/shows')
+@main.route('/shows')
 def shows():
-    shows = []
-    for show in Show.query.order_by(Show.start_time).all():
-        d = {'venue_id': show.venue_id, 'artist_id': show.artist_id, 'start_time': str(show.start_time)}
-        d['venue_name'] = show.venue.name
-        artist = show.artist
-        d['artist_name'] = artist.name
-        d['artist_image_link'] = artist.image_link
-        shows.append(d)
-    return render_template('pages/shows.html', shows=shows)
-
-@app.route('/shows/create')
+    start, end = date_arg('from'), date_arg('to')
+    try:
+        page = show_rows(request.args.get('after'), limit_arg(current_app.config['SHOWS_PER_PAGE']), start, end,
+                         show_tile)
+    except ValueError:
+        abort(400)
+    return render_listing('pages/shows.html', shows=listing_rows(page), page=page, start=start, end=end)
+
+def render_calendar(title, first, days, feed_url=None):
+    previous = (first - timedelta(days=1)).strftime('%Y-%m')
+    return render_template('pages/calendar.html', title=title, month=first, weeks=month_weeks(first), days=days,
+                           previous=previous, next=(first + timedelta(days=32)).strftime('%Y-%m'),
+                           feed_url=feed_url)
+
+@main.route('/shows/calendar')
+def shows_calendar():
+    first, end = month_arg()
+    days = {}
+    for day, count in daily_show_counts(first, end).items():
+        params = {'from': day.isoformat(), 'to': (day + timedelta(days=1)).isoformat()}
+        days[day] = {'count': count, 'url': url_for('main.shows', **params), 'shows': []}
+    return render_calendar('All shows', first, days)
+
+def calendar_days(rows):
+    days = {}
+    for day, day_shows in groupby(rows, key=lambda show: show.start_time.date()):
+        day_shows = list(day_shows)
+        days[day] = {'count': len(day_shows), 'url': None, 'shows': day_shows}
+    return days
+
+@main.route('/venues/<int:venue_id>/calendar')
+def venue_calendar(venue_id):
+    venue = Venue.query.get(venue_id)
+    if venue is None:
+        abort(404)
+    first, end = month_arg()
+    return render_calendar(venue.name, first, calendar_days(shows_between(first, end, Show.venue_id==venue_id)),
+                           url_for('main.venue_feed', venue_id=venue_id))
+
+@main.route('/artists/<int:artist_id>/calendar')
+def artist_calendar(artist_id):
+    artist = Artist.query.get(artist_id)
+    if artist is None:
+        abort(404)
+    first, end = month_arg()
+    return render_calendar(artist.name, first, calendar_days(shows_between(first, end, Show.artist_id==artist_id)),
+                           url_for('main.artist_feed', artist_id=artist_id))
+
+def feed_response(name, *criteria):
+    # ?from=&to= window, by default the last month and the coming year
+    start = date_arg('from') or datetime.now() - timedelta(days=31)
+    end = date_arg('to') or start + timedelta(days=31 + 366)
+    if end <= start or end - start > timedelta(days=current_app.config['FEED_MAX_WINDOW_DAYS']):
+        abort(400)
+    events = [{'id': show.id, 'start': show.start_time, 'end': show.end_time,
+               'summary': '{} at {}'.format(show.artist_name, show.venue_name),
+               'location': ', '.join(part for part in (show.address, show.city, show.state) if part),
+               'url': url_for('main.show_venue', venue_id=show.venue_id, _external=True)}
+              for show in shows_between(start, end, *criteria)]
+    response = Response(ics_feed(name, events, request.host), mimetype='text/calendar')
+    response.headers['Cache-Control'] = 'public, max-age={}'.format(current_app.config['FEED_MAX_AGE'])
+    return response
+
+@main.route('/venues/<int:venue_id>/shows.ics')
+def venue_feed(venue_id):
+    venue = Venue.query.get(venue_id)
+    if venue is None:
+        abort(404)
+    return feed_response(venue.name, Show.venue_id==venue_id)
+
+@main.route('/artists/<int:artist_id>/shows.ics')
+def artist_feed(artist_id):
+    artist = Artist.query.get(artist_id)
+    if artist is None:
+        abort(404)
+    return feed_response(artist.name, Show.artist_id==artist_id)
+
+@main.route('/shows/create')
 def create_shows():
   # renders form. do not touch.
   form = ShowForm()
   return render_template('forms/new_show.html', form=form)
 
-@app.route('/shows/create', methods=['POST'])
+@main.route('/shows/create', methods=['POST'])
 def create_show_submission():
     show = Show()
     form = ShowForm()
     if not form.validate_on_submit():
         flash('Invalid value found in ' + ', '.join(form.errors.keys()) + ' field(s).')
         return render_template('forms/new_show.html', form=form)
+    conflict = booking_conflict(form.venue_id.data, form.artist_id.data, form.start_time.data,
+                                show_end_time(form.start_time.data))
+    if conflict:
+        flash(conflict)
+        return render_template('forms/new_show.html', form=form), 409
     else:
         error = False
         try:
             form.populate_obj(show)
+            show.end_time = show_end_time(show.start_time)
             db.session.add(show)
             db.session.flush()
+            record_show(show)
             db.session.commit()
+            bookings.record(show)
+            cache_keys = ['venue:{}'.format(show.venue_id), 'artist:{}'.format(show.artist_id)]
+            cache.delete(*cache_keys)
+            fragments.invalidate(*cache_keys)
         except:
             error = True
             db.session.rollback()
@@ -417,38 +1104,290 @@ def create_show_submission():
             flash('An error occurred. Show could not be listed.')
         else:
             flash('Show was successfully listed!')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
+
+#  API
+#  ----------------------------------------------------------------
+
+def to_json(value):
+    if isinstance(value, dict):
+        return {key: to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def conditional_json(etag, build):
+    # If-None-Match uses the weak comparison: a proxy that compresses the body
+    # hands the tag back as W/"..."
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        payload = build()
+        if payload is None:
+            abort(404)
+        response = jsonify(to_json(payload))
+    response.set_etag(etag)
+    return response
+
+def search_json(model, search_term, after, limit):
+    # The matches are only known once the search has run, so the body is
+    # built up front and its hash is the ETag; a 304 saves the transfer.
+    payload = search_results(model, search_term, after, limit)
+    return conditional_json(etag_of(to_json(payload)), lambda: payload)
 
-@app.errorhandler(404)
+@main.route('/api/v1/venues')
+def api_venues():
+    after, limit = page_args(current_app.config['PAGE_SIZE'])
+    try:
+        etag = page_etag(venue_rows(after, limit), Venue.id, Venue.updated_at, limit=limit)
+    except ValueError:
+        abort(400)
+
+    def build():
+        areas, next_after = venue_areas(after, limit)
+        return {'areas': areas, 'next': next_after}
+
+    return conditional_json(etag, build)
+
+@main.route('/api/v1/venues/search')
+def api_search_venues():
+    search_term = request.args.get('search_term', '')
+    after, limit = page_args(current_app.config['SEARCH_RESULT_LIMIT'])
+    return search_json(Venue, search_term, after, limit)
+
+@main.route('/api/v1/venues/<int:venue_id>')
+def api_venue(venue_id):
+    artists_updated = db.session.query(db.func.max(Artist.updated_at)) \
+        .join(Show, Show.artist_id==Artist.id).filter(Show.venue_id==venue_id).scalar_subquery()
+    etag = resource_etag(*row_version(Venue, Venue.id==venue_id), *row_version(Show, Show.venue_id==venue_id),
+                         artists_updated, started_shows(Show.venue_id==venue_id))
+    # built fresh: a cached body could be older than the ETag computed above
+    return conditional_json(etag, lambda: venue_detail(venue_id))
+
+@main.route('/api/v1/artists')
+def api_artists():
+    after, limit = page_args(current_app.config['PAGE_SIZE'])
+    etag = page_etag(artist_rows(after, limit), Artist.id, Artist.updated_at, limit=limit)
+
+    def build():
+        artists, next_after = artist_page(after, limit)
+        return {'artists': [{'id': id, 'name': name} for id, name in artists], 'next': next_after}
+
+    return conditional_json(etag, build)
+
+@main.route('/api/v1/artists/search')
+def api_search_artists():
+    search_term = request.args.get('search_term', '')
+    after, limit = page_args(current_app.config['SEARCH_RESULT_LIMIT'])
+    return search_json(Artist, search_term, after, limit)
+
+@main.route('/api/v1/artists/<int:artist_id>')
+def api_artist(artist_id):
+    venues_updated = db.session.query(db.func.max(Venue.updated_at)) \
+        .join(Show, Show.venue_id==Venue.id).filter(Show.artist_id==artist_id).scalar_subquery()
+    etag = resource_etag(*row_version(Artist, Artist.id==artist_id), *row_version(Show, Show.artist_id==artist_id),
+                         venues_updated, started_shows(Show.artist_id==artist_id))
+    return conditional_json(etag, lambda: artist_detail(artist_id))
+
+def availability_window():
+    # ?from=&to= as ISO dates or datetimes; a week from now by default and at
+    # most BOOKING_MAX_WINDOW_DAYS long.
+    start = date_arg('from') or datetime.now()
+    end = date_arg('to') or start + timedelta(days=7)
+    if end <= start or end - start > timedelta(days=current_app.config['BOOKING_MAX_WINDOW_DAYS']):
+        abort(400)
+    return start, end
+
+@main.route('/api/v1/venues/<int:venue_id>/availability')
+def api_venue_availability(venue_id):
+    start, end = availability_window()
+    if db.session.query(Venue.id).filter_by(id=venue_id).scalar() is None:
+        abort(404)
+    return jsonify(to_json(availability(Show.venue_id, venue_id, start, end)))
+
+@main.route('/api/v1/artists/<int:artist_id>/availability')
+def api_artist_availability(artist_id):
+    start, end = availability_window()
+    if db.session.query(Artist.id).filter_by(id=artist_id).scalar() is None:
+        abort(404)
+    return jsonify(to_json(availability(Show.artist_id, artist_id, start, end)))
+
+@main.route('/api/v1/shows')
+def api_shows():
+    after = request.args.get('after')
+    start, end = date_arg('from'), date_arg('to')
+    per_page = current_app.config['SHOWS_PER_PAGE']
+    try:
+        etag = page_etag(show_rows(after, per_page, start, end), Show.id, Show.updated_at, Venue.updated_at,
+                         Artist.updated_at, per_page=per_page)
+    except ValueError:
+        abort(400)
+
+    def build():
+        shows, next_cursor = show_page(after, per_page, start, end)
+        return {'shows': shows, 'next': next_cursor}
+
+    return conditional_json(etag, build)
+
+#  Bulk import/export
+#  ----------------------------------------------------------------
+
+def prepare_contact(data):
+    data['phone'] = format_phone(data['phone'])
+    return data
+
+BULK_TABLES = {
+    'venues': (Venue, VenueForm, prepare_contact),
+    'artists': (Artist, ArtistForm, prepare_contact),
+    'shows': (Show, ShowForm, None),
+}
+
+def bulk_import(kind, stream, format):
+    model, form_class, prepare = BULK_TABLES[kind]
+    inserted, errors = import_rows(db.session, model.__table__, form_class, read_rows(stream, format),
+                                   current_app.config['BULK_BATCH_SIZE'], prepare)
+    if inserted and model is Show:
+        refresh_show_counters(Venue, Show.venue_id)
+        refresh_show_counters(Artist, Show.artist_id)
+        db.session.commit()
+    elif inserted:
+        facets.rebuild(model)
+        db.session.commit()
+    if inserted:
+        search.invalidate(model)
+        bookings.invalidate()
+        cache.clear()
+        fragments.clear()
+    return inserted, errors
+
+def import_authorized():
+    token = current_app.config.get('IMPORT_API_TOKEN')
+    scheme, _, supplied = request.headers.get('Authorization', '').partition(' ')
+    return bool(token) and scheme.lower() == 'bearer' and hmac.compare_digest(supplied.encode(), token.encode())
+
+@main.route('/<any(venues, artists, shows):kind>/import', methods=['POST'])
+@csrf.exempt
+def import_submission(kind):
+    if not import_authorized():
+        abort(403)
+    upload = request.files.get('file')
+    if upload:
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8')
+        format = guess_format(upload.filename, request.args.get('format', 'csv'))
+    else:
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8')
+        format = request.args.get('format', 'csv')
+    if format not in FORMATS:
+        abort(400)
+    try:
+        inserted, errors = bulk_import(kind, stream, format)
+    except Exception:
+        current_app.logger.exception('Bulk import of %s failed', kind)
+        return jsonify({'inserted': 0, 'error': 'Rows could not be inserted.'}), 400
+    return jsonify({'inserted': inserted, 'errors': errors})
+
+@main.route('/<any(venues, artists, shows):kind>/export.<any(csv, ndjson):format>')
+def export(kind, format):
+    table = BULK_TABLES[kind][0].__table__
+    query = db.session.query(*table.columns).order_by(table.c.id)
+    rows = export_rows(query, table.columns.keys(), format, current_app.config['BULK_BATCH_SIZE'])
+    mimetype = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(rows), mimetype=mimetype,
+                    headers={'Content-Disposition': 'attachment; filename={}.{}'.format(kind, format)})
+
+@main.cli.command('import')
+@click.argument('kind', type=click.Choice(sorted(BULK_TABLES)))
+@click.argument('file', type=click.File('r'))
+@click.option('--format', type=click.Choice(FORMATS), help='Defaults to the file extension, or csv.')
+def import_command(kind, file, format):
+    """Import venues, artists or shows from a CSV or NDJSON file."""
+    inserted, errors = bulk_import(kind, file, format or guess_format(file.name))
+    for error in errors:
+        click.echo('line {}: {}'.format(error['line'], error['errors']), err=True)
+    click.echo('Imported {} {}, skipped {} invalid rows.'.format(inserted, kind, len(errors)))
+
+@main.cli.command('export')
+@click.argument('kind', type=click.Choice(sorted(BULK_TABLES)))
+@click.argument('file', type=click.File('w'), default='-')
+@click.option('--format', type=click.Choice(FORMATS), help='Defaults to the file extension, or csv.')
+def export_command(kind, file, format):
+    """Export venues, artists or shows as CSV or NDJSON."""
+    table = BULK_TABLES[kind][0].__table__
+    query = db.session.query(*table.columns).order_by(table.c.id)
+    for chunk in export_rows(query, table.columns.keys(), format or guess_format(file.name), current_app.config['BULK_BATCH_SIZE']):
+        file.write(chunk)
+
+@main.cli.command('rollover-shows')
+def rollover_shows_command():
+    """Move shows that have started from the upcoming to the past counters."""
+    rollover_shows()
+    click.echo('Show counters rolled over.')
+
+@main.cli.command('rebuild-facets')
+def rebuild_facets_command():
+    """Recount the venue and artist facets from scratch."""
+    for model in (Venue, Artist):
+        facets.rebuild(model)
+    db.session.commit()
+    click.echo('Facet counts rebuilt.')
+
+@main.cli.command('check-db')
+@click.option('--workers', type=int, default=1, help='Number of worker processes sharing the database.')
+def check_db_command(workers):
+    """Check the database is reachable and the worker pools fit its connection limit."""
+    problems = check_database(current_app, workers)
+    for problem in problems:
+        click.echo(problem, err=True)
+    if problems:
+        raise SystemExit(1)
+    click.echo('Database OK.')
+
+@main.cli.command('run-jobs')
+@click.option('--workers', type=int, default=None, help='Worker threads (default JOBS_WORKERS).')
+def run_jobs_command(workers):
+    """Run background job workers until interrupted."""
+    threads = jobs.start(workers)
+    click.echo('Running {} job worker(s).'.format(len(threads)))
+    try:
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(1)
+    except KeyboardInterrupt:
+        jobs.stop()
+
+@main.cli.command('build-assets')
+def build_assets_command():
+    """Bundle, minify and precompress static assets into static/dist."""
+    manifest = build_assets(current_app.static_folder)
+    assets.load()
+    for name, filename in sorted(manifest.items()):
+        click.echo('{} -> {}'.format(name, filename))
+
+@main.app_errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
-@app.errorhandler(500)
+@main.app_errorhandler(500)
 def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
-
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
 
+# The process-wide instance is built in wsgi.py; `flask` finds create_app by
+# itself, and tests and benchmarks build their own.
+
 # Default port:
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
 
 # Or specify port manually:
 '''
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
+    create_app().run(host='0.0.0.0', port=port)
 '''
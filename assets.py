@@ -0,0 +1,143 @@
+"""Static asset bundles with content-hashed names and precompressed variants.
+
+``flask build-assets`` concatenates each bundle in ``BUNDLES``, minifies it
+(with rcssmin/rjsmin when installed, otherwise a conservative built-in CSS
+minifier and plain concatenation for the already-minified JS), writes it to
+``static/dist/<name>.<hash>.<ext>`` with gzip and, when the brotli package
+is available, brotli variants, and records the names in
+``static/dist/manifest.json``.
+
+Templates call ``asset_urls('main.css')``: the hashed bundle once built, the
+individual source files otherwise, so development works without a build
+(with ``ASSETS_BUNDLED``, the production default, the gunicorn startup check
+refuses to start without the manifest instead). Bundles are served from
+``/static/dist/`` with the best encoding the client accepts and a year-long
+immutable Cache-Control; the hash in the name does the cache busting.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+from flask import abort, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+BUNDLES = {
+    'main.css': ['css/bootstrap.min.css', 'css/layout.main.css', 'css/main.css',
+                 'css/main.responsive.css', 'css/main.quickfix.css'],
+    'head.js': ['js/libs/modernizr-2.8.2.min.js', 'js/libs/moment.min.js'],
+    'main.js': ['js/libs/jquery-1.11.1.min.js', 'js/libs/bootstrap-3.1.1.min.js',
+                'js/plugins.js', 'js/script.js'],
+}
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def minify_css(source):
+    if rcssmin is not None:
+        return rcssmin.cssmin(source)
+    source = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+    source = re.sub(r'\s+', ' ', source)
+    source = re.sub(r'\s*([{};,>])\s*', r'\1', source)
+    return source.replace(';}', '}').strip()
+
+
+def minify_js(source):
+    if rjsmin is not None:
+        return rjsmin.jsmin(source)
+    return source
+
+
+def build(static_folder, bundles=BUNDLES):
+    """Write every bundle and its compressed variants; return the manifest."""
+    dist = os.path.join(static_folder, DIST)
+    os.makedirs(dist, exist_ok=True)
+    manifest = {}
+    for name, sources in sorted(bundles.items()):
+        parts = []
+        for source in sources:
+            with open(os.path.join(static_folder, source), encoding='utf-8') as f:
+                parts.append(f.read())
+        base, ext = os.path.splitext(name)
+        if ext == '.css':
+            content = minify_css('\n'.join(parts))
+        else:
+            # a statement terminator between files keeps ASI-dependent sources apart
+            content = minify_js(';\n'.join(parts))
+        data = content.encode('utf-8')
+        filename = '{}.{}{}'.format(base, hashlib.sha256(data).hexdigest()[:12], ext)
+        path = os.path.join(dist, filename)
+        with open(path, 'wb') as f:
+            f.write(data)
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzip.compress(data, 9))
+        if brotli is not None:
+            with open(path + '.br', 'wb') as f:
+                f.write(brotli.compress(data))
+        manifest[name] = filename
+    with open(os.path.join(dist, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+class Assets(object):
+
+    def __init__(self, app=None):
+        self.manifest = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASSETS_BUNDLED', False)
+        self.static_folder = app.static_folder
+        self.load()
+        app.add_url_rule('/static/{}/<path:filename>'.format(DIST), 'dist', self.serve)
+        app.jinja_env.globals['asset_urls'] = self.urls
+        app.extensions['assets'] = self
+
+    def load(self):
+        try:
+            with open(os.path.join(self.static_folder, DIST, MANIFEST)) as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def urls(self, name):
+        if name in self.manifest:
+            return [url_for('dist', filename=self.manifest[name])]
+        return [url_for('static', filename=source) for source in BUNDLES[name]]
+
+    def serve(self, filename):
+        if filename == MANIFEST:
+            abort(404)
+        directory = os.path.join(self.static_folder, DIST)
+        accepted = request.accept_encodings
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if accepted[encoding] and os.path.isfile(os.path.join(directory, filename + suffix)):
+                response = send_from_directory(directory, filename + suffix, max_age=31536000)
+                response.headers['Content-Encoding'] = encoding
+                response.mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                break
+        else:
+            response = send_from_directory(directory, filename, max_age=31536000)
+        response.headers['Cache-Control'] = IMMUTABLE
+        response.vary.add('Accept-Encoding')
+        return response
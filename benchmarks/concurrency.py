@@ -0,0 +1,82 @@
+"""Throughput of running Fyyur servers under concurrent clients.
+
+    $ ASYNC_DATABASE_URI= gunicorn -w 4 -b :8000 wsgi:app &
+    $ ASYNC_DATABASE_URI=postgresql+asyncpg://postgres@localhost/fyyur gunicorn -w 4 -b :8001 wsgi:app &
+    $ python benchmarks/concurrency.py --target sync=http://127.0.0.1:8000 \\
+          --target async=http://127.0.0.1:8001 --clients 100 --requests 5000
+
+Each client thread requests venue and artist detail pages (ids drawn from
+--max-id) back to back until the shared request budget is spent. Run the
+servers with CACHE_TYPE = 'null' so every request reaches the database.
+"""
+import argparse
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def run(base_url, clients, requests, max_id, paths):
+    remaining = [requests]
+    lock = threading.Lock()
+    latencies, errors = [], [0]
+
+    def client(seed):
+        rng = random.Random(seed)
+        while True:
+            with lock:
+                if remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+            url = base_url + rng.choice(paths).format(rng.randint(1, max_id))
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(url) as response:
+                    response.read()
+            except Exception:
+                with lock:
+                    errors[0] += 1
+                continue
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(client, range(clients)))
+    elapsed = time.perf_counter() - start
+    return {'throughput': len(latencies) / elapsed, 'errors': errors[0],
+            'p50_ms': percentile(latencies, 0.5) if latencies else 0,
+            'p99_ms': percentile(latencies, 0.99) if latencies else 0,
+            'mean_ms': statistics.mean(latencies) if latencies else 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', action='append', required=True, metavar='LABEL=URL')
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--max-id', type=int, default=1000)
+    parser.add_argument('--path', action='append', help='path template with {} for the id')
+    args = parser.parse_args()
+    paths = args.path or ['/venues/{}', '/artists/{}']
+
+    print('{:<10} {:>10} {:>10} {:>10} {:>10} {:>7}'.format('target', 'req/s', 'mean ms', 'p50 ms', 'p99 ms', 'errors'))
+    for target in args.target:
+        label, _, url = target.partition('=')
+        if not url:
+            sys.exit('--target must look like LABEL=URL')
+        result = run(url.rstrip('/'), args.clients, args.requests, args.max_id, paths)
+        print('{:<10} {throughput:>10.1f} {mean_ms:>10.2f} {p50_ms:>10.2f} {p99_ms:>10.2f} {errors:>7}'
+              .format(label, **result))
+
+
+if __name__ == '__main__':
+    main()
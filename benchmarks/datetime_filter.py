@@ -0,0 +1,58 @@
+"""Per-call cost of the ``datetime`` template filter on a 10k-show page.
+
+    $ python benchmarks/datetime_filter.py --shows 10000
+
+Compares the old path (view stringifies start_time, filter re-parses it with
+dateutil and formats with babel.dates.format_datetime) against the current
+memoised filter fed datetime objects, both on a cold and a warm cache.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import babel.dates
+import dateutil.parser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import DATETIME_FORMATS, format_datetime  # noqa: E402
+
+
+def legacy_format_datetime(value, format='medium'):
+    date = dateutil.parser.parse(value)
+    return babel.dates.format_datetime(date, DATETIME_FORMATS.get(format, format))
+
+
+def per_call_us(fn, values):
+    start = time.perf_counter()
+    for value in values:
+        fn(value, 'full')
+    return (time.perf_counter() - start) / len(values) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--shows', type=int, default=10000)
+    parser.add_argument('--distinct', type=int, default=2000, help='distinct start times among the shows')
+    args = parser.parse_args()
+
+    base = datetime(2026, 1, 1, 20, 0)
+    times = [base + timedelta(hours=i % args.distinct) for i in range(args.shows)]
+
+    legacy = per_call_us(legacy_format_datetime, [str(t) for t in times])
+    format_datetime.cache_clear()
+    cold = per_call_us(format_datetime, times)
+    warm = per_call_us(format_datetime, times)
+    assert all(format_datetime(t, 'full') == legacy_format_datetime(str(t), 'full') for t in times[:100])
+
+    print('{} show tiles, {} distinct start times'.format(args.shows, args.distinct))
+    print('{:<34} {:>10.2f} us/call {:>9.1f} ms/page'.format('legacy (str -> parse -> babel)', legacy,
+                                                            legacy * args.shows / 1000))
+    print('{:<34} {:>10.2f} us/call {:>9.1f} ms/page'.format('memoised, cold cache', cold, cold * args.shows / 1000))
+    print('{:<34} {:>10.2f} us/call {:>9.1f} ms/page'.format('memoised, warm cache', warm, warm * args.shows / 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Compare query plans and timings for the hot Show/Venue access paths with
+and without the indexes added in migration 84a91cab2e6f.
+
+    $ python benchmarks/explain_indexes.py --seed-venues 5000 --seed-artists 5000 --seed-shows 1000000
+
+Needs a PostgreSQL database (the configured SQLALCHEMY_DATABASE_URI). The
+indexes are dropped for the "before" run and recreated for the "after" run,
+so do not point this at a database you care about.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db, Venue, Show  # noqa: E402
+from seed import seed  # noqa: E402
+
+INDEXES = [index for model in (Venue, Show) for index in model.__table__.indexes]
+
+QUERIES = {
+    'venue detail upcoming': 'SELECT * FROM "Show" WHERE venue_id = :venue_id AND start_time >= now() '
+                             'ORDER BY start_time',
+    'venue detail past': 'SELECT * FROM "Show" WHERE venue_id = :venue_id AND start_time < now() '
+                         'ORDER BY start_time DESC',
+    'artist detail upcoming': 'SELECT * FROM "Show" WHERE artist_id = :artist_id AND start_time >= now() '
+                              'ORDER BY start_time',
+    'upcoming counts batch': 'SELECT venue_id, count(id) FROM "Show" WHERE venue_id IN (:venue_id, :venue_id + 1, '
+                             ':venue_id + 2) AND start_time >= now() GROUP BY venue_id',
+    'shows first page': 'SELECT * FROM "Show" ORDER BY start_time, id LIMIT 31',
+    'venues in area': 'SELECT id, name FROM "Venue" WHERE city = :city AND state = :state ORDER BY id',
+}
+
+
+def run(connection, label, params, repeat):
+    print('=' * 78)
+    print(label)
+    print('=' * 78)
+    timings = {}
+    for name, sql in QUERIES.items():
+        plan = connection.execute(db.text('EXPLAIN (ANALYZE, BUFFERS) ' + sql), params).scalars().all()
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            connection.execute(db.text(sql), params).fetchall()
+            samples.append((time.perf_counter() - start) * 1000)
+        timings[name] = statistics.median(samples)
+        print('\n-- {} (median {:.2f} ms over {} runs)'.format(name, timings[name], repeat))
+        print('\n'.join(plan))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seed-venues', type=int, default=0)
+    parser.add_argument('--seed-artists', type=int, default=0)
+    parser.add_argument('--seed-shows', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.seed_shows:
+        seed(args.seed_venues, args.seed_artists, args.seed_shows)
+
+    app = create_app()
+    with app.app_context():
+        if db.engine.dialect.name != 'postgresql':
+            sys.exit('explain_indexes.py needs a PostgreSQL database')
+        with db.engine.connect() as connection:
+            venue = connection.execute(db.text('SELECT id, city, state FROM "Venue" ORDER BY id LIMIT 1')).first()
+            if venue is None:
+                sys.exit('database is empty, pass --seed-* to populate it')
+            params = {'venue_id': venue.id, 'artist_id': venue.id, 'city': venue.city, 'state': venue.state}
+
+            for index in INDEXES:
+                index.drop(connection, checkfirst=True)
+            connection.execute(db.text('ANALYZE'))
+            before = run(connection, 'WITHOUT INDEXES', params, args.repeat)
+
+            for index in INDEXES:
+                index.create(connection)
+            connection.execute(db.text('ANALYZE'))
+            after = run(connection, 'WITH INDEXES', params, args.repeat)
+            connection.commit()
+
+    print('=' * 78)
+    print('{:<28} {:>12} {:>12} {:>9}'.format('query', 'before (ms)', 'after (ms)', 'speedup'))
+    for name in QUERIES:
+        print('{:<28} {:>12.2f} {:>12.2f} {:>8.1f}x'.format(name, before[name], after[name],
+                                                          before[name] / max(after[name], 1e-6)))
+
+
+if __name__ == '__main__':
+    main()
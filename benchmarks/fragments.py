@@ -0,0 +1,67 @@
+"""Render time of the show tile pages with and without fragment caching.
+
+    $ python benchmarks/fragments.py --shows 1000 --repeat 20
+
+Renders pages/shows.html and pages/show_venue.html from synthetic payloads,
+so only template work is measured: once with the {% cache %} tag disabled,
+once against an empty fragment store and once against a warm one.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from flask import render_template
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, fragments  # noqa: E402
+
+
+def payloads(count):
+    base = datetime(2026, 1, 1, 20, 0)
+    shows = [{'id': i, 'venue_id': i % 50 + 1, 'artist_id': i % 200 + 1, 'start_time': base + timedelta(hours=i),
+              'venue_name': 'Venue {}'.format(i % 50 + 1), 'artist_name': 'Artist {}'.format(i % 200 + 1),
+              'artist_image_link': 'https://example.com/artists/{}.jpg'.format(i % 200 + 1)} for i in range(count)]
+    venue = {'id': 1, 'name': 'Venue 1', 'genres': ['Jazz', 'Folk'], 'city': 'San Francisco', 'state': 'CA',
+             'address': '1 Main St', 'phone': '415-000-0000', 'website': None, 'facebook_link': None,
+             'seeking_talent': False, 'seeking_description': None, 'image_link': None,
+             'past_shows': shows[:count // 2], 'upcoming_shows': shows[count // 2:],
+             'past_shows_count': count // 2, 'upcoming_shows_count': count - count // 2}
+    return [('pages/shows.html', {'shows': shows, 'page': {'next': None}}),
+            ('pages/show_venue.html', {'venue': venue})]
+
+
+def timed(template, context, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render_template(template, **context)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--shows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    print('{} show tiles, median of {} renders'.format(args.shows, args.repeat))
+    print('{:<24} {:>12} {:>12} {:>12}'.format('template', 'uncached ms', 'cold ms', 'warm ms'))
+    app = create_app()
+    with app.test_request_context():
+        for template, context in payloads(args.shows):
+            app.jinja_env.fragment_cache = None
+            uncached = timed(template, context, args.repeat)
+            app.jinja_env.fragment_cache = app.extensions['fragments']
+            fragments.clear()
+            cold = timed(template, context, 1)
+            warm = timed(template, context, args.repeat)
+            print('{:<24} {:>12.2f} {:>12.2f} {:>12.2f}'.format(template, uncached, cold, warm))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""Measure latency percentiles and query counts for every Fyyur read route.
+
+    $ python benchmarks/routes.py --dataset 10k --reset --output report.json
+    $ python benchmarks/routes.py --baseline report.json
+
+Requests go through the Flask test client against the configured database,
+so the numbers cover routing, queries and rendering but not the network.
+Statement counts come from the X-Query-Count header added by metrics.py.
+With --baseline the run is compared against an earlier report and exits
+non-zero when any route's p50 or query count regresses past --tolerance.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db, Venue, Artist  # noqa: E402
+from seed import seed  # noqa: E402
+
+DATASETS = {
+    '1k': (1000, 1000, 10000),
+    '10k': (10000, 10000, 100000),
+    '100k': (100000, 100000, 1000000),
+}
+
+
+def routes(venue_ids, artist_ids, rng):
+    return [
+        ('GET /venues', lambda client: client.get('/venues')),
+        ('GET /artists', lambda client: client.get('/artists')),
+        ('GET /shows', lambda client: client.get('/shows')),
+        ('POST /venues/search', lambda client: client.post('/venues/search', data={'search_term': 'Music'})),
+        ('POST /artists/search', lambda client: client.post('/artists/search', data={'search_term': 'band'})),
+        ('GET /venues/<id>', lambda client: client.get('/venues/{}'.format(rng.choice(venue_ids)))),
+        ('GET /artists/<id>', lambda client: client.get('/artists/{}'.format(rng.choice(artist_ids)))),
+    ]
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def measure(client, request, iterations, warmup):
+    for _ in range(warmup):
+        request(client)
+    samples, queries = [], []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        response = request(client)
+        samples.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError('unexpected status {}'.format(response.status_code))
+        queries.append(int(response.headers.get('X-Query-Count', 0)))
+    return {'p50_ms': round(percentile(samples, 0.5), 3), 'p90_ms': round(percentile(samples, 0.9), 3),
+            'p99_ms': round(percentile(samples, 0.99), 3), 'mean_ms': round(statistics.mean(samples), 3),
+            'queries': max(queries), 'iterations': iterations}
+
+
+def compare(report, baseline, tolerance):
+    regressions = []
+    for route, result in report['routes'].items():
+        previous = baseline['routes'].get(route)
+        if previous is None:
+            continue
+        if result['p50_ms'] > previous['p50_ms'] * (1 + tolerance):
+            regressions.append('{}: p50 {:.2f} ms -> {:.2f} ms'.format(route, previous['p50_ms'], result['p50_ms']))
+        if result['queries'] > previous['queries']:
+            regressions.append('{}: {} -> {} queries'.format(route, previous['queries'], result['queries']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dataset', choices=sorted(DATASETS), help='seed venues/artists/shows of this size first')
+    parser.add_argument('--reset', action='store_true', help='drop and recreate all tables before seeding')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--cache', action='store_true', help='keep the detail page cache enabled')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='compare against this earlier JSON report')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p50 slowdown, as a fraction')
+    args = parser.parse_args()
+
+    settings = {'WTF_CSRF_ENABLED': False, 'METRICS_QUERY_COUNT_HEADER': True}
+    if not args.cache:
+        settings['CACHE_TYPE'] = 'null'
+    app = create_app(**settings)
+
+    if args.reset:
+        with app.app_context():
+            db.drop_all()
+    if args.dataset:
+        seed(*DATASETS[args.dataset])
+
+    with app.app_context():
+        venue_ids = [id for id, in Venue.query.with_entities(Venue.id)]
+        artist_ids = [id for id, in Artist.query.with_entities(Artist.id)]
+        dialect = db.engine.dialect.name
+    if not venue_ids or not artist_ids:
+        sys.exit('database is empty, pass --dataset to seed it')
+
+    client = app.test_client()
+    rng = random.Random(0)
+    report = {'dataset': {'venues': len(venue_ids), 'artists': len(artist_ids), 'dialect': dialect},
+              'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'routes': {}}
+    for name, request in routes(venue_ids, artist_ids, rng):
+        report['routes'][name] = measure(client, request, args.iterations, args.warmup)
+        print('{:<22} p50 {p50_ms:>9.2f} ms  p99 {p99_ms:>9.2f} ms  {queries:>3} queries'
+              .format(name, **report['routes'][name]), file=sys.stderr)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Seed the configured database with a synthetic Fyyur catalogue.
+
+    $ python benchmarks/seed.py --venues 10000 --artists 10000 --shows 100000
+
+Rows are generated deterministically from --seed and inserted with batched
+multi-row statements, so the same arguments always produce the same data.
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db, facets, Venue, Artist, Show, refresh_show_counters  # noqa: E402
+
+CITIES = [('San Francisco', 'CA'), ('New York', 'NY'), ('Austin', 'TX'), ('Seattle', 'WA'),
+          ('Chicago', 'IL'), ('Nashville', 'TN'), ('Denver', 'CO'), ('Boston', 'MA')]
+GENRES = ['Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk', 'Funk',
+          'Hip-Hop', 'Jazz', 'Pop', 'Punk', 'R&B', 'Reggae', 'Rock n Roll', 'Soul']
+WORDS = ['Musical', 'Hop', 'Dueling', 'Pianos', 'Park', 'Square', 'Live', 'Music', 'Coffee',
+         'Guns', 'Petty', 'Quarrel', 'Wild', 'Sax', 'Band', 'The', 'Blue', 'Hall', 'Room']
+
+
+def _name(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 4)))
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _insert(table, rows, batch_size):
+    for batch in _batches(rows, batch_size):
+        db.session.execute(table.insert(), batch)
+    db.session.commit()
+
+
+def seed(venues, artists, shows, batch_size=5000, random_seed=0):
+    rng = random.Random(random_seed)
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+
+    def venue_rows():
+        for _ in range(venues):
+            city, state = rng.choice(CITIES)
+            yield {'name': _name(rng) + ' Venue', 'genres': rng.sample(GENRES, 2), 'city': city,
+                   'state': state, 'address': '{} Main St'.format(rng.randint(1, 9999)),
+                   'phone': '415-000-{:04d}'.format(rng.randint(0, 9999)),
+                   'image_link': 'https://images.example.com/venue/{}.jpg'.format(rng.randint(1, 500)),
+                   'seeking_talent': rng.random() < 0.5}
+
+    def artist_rows():
+        for _ in range(artists):
+            city, state = rng.choice(CITIES)
+            yield {'name': _name(rng), 'genres': rng.sample(GENRES, 2), 'city': city, 'state': state,
+                   'phone': '326-000-{:04d}'.format(rng.randint(0, 9999)),
+                   'image_link': 'https://images.example.com/artist/{}.jpg'.format(rng.randint(1, 500)),
+                   'seeking_venue': rng.random() < 0.5}
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        first_venue = (db.session.query(db.func.max(Venue.id)).scalar() or 0) + 1
+        first_artist = (db.session.query(db.func.max(Artist.id)).scalar() or 0) + 1
+        _insert(Venue.__table__, venue_rows(), batch_size)
+        _insert(Artist.__table__, artist_rows(), batch_size)
+        for model in (Venue, Artist):
+            facets.rebuild(model, batch_size)
+        db.session.commit()
+
+        def show_rows():
+            # roughly two years of history and one year of upcoming shows, on a
+            # grid of show-length slots so no venue or artist is double booked
+            slot = app.config['SHOW_DURATION_MINUTES']
+            taken = set()
+            for _ in range(shows):
+                while True:
+                    venue_id = first_venue + rng.randrange(venues)
+                    artist_id = first_artist + rng.randrange(artists)
+                    n = rng.randint(-2 * 365 * 24 * 60 // slot, 365 * 24 * 60 // slot)
+                    if ('venue', venue_id, n) not in taken and ('artist', artist_id, n) not in taken:
+                        break
+                taken.update((('venue', venue_id, n), ('artist', artist_id, n)))
+                yield {'venue_id': venue_id, 'artist_id': artist_id,
+                       'start_time': now + timedelta(minutes=n * slot)}
+
+        if venues and artists:
+            _insert(Show.__table__, show_rows(), batch_size)
+            refresh_show_counters(Venue, Show.venue_id)
+            refresh_show_counters(Artist, Show.artist_id)
+            db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--venues', type=int, default=1000)
+    parser.add_argument('--artists', type=int, default=1000)
+    parser.add_argument('--shows', type=int, default=10000)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    seed(args.venues, args.artists, args.shows, args.batch_size, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Time to first byte and peak RSS of the listings, buffered and streamed.
+
+    $ python benchmarks/streaming.py --dataset 10k --reset
+    $ python benchmarks/streaming.py --limit 100000 --routes shows
+
+Every route and mode runs in a fresh interpreter, since ru_maxrss only ever
+grows: the child warms the route up with a one-row page, notes its RSS
+high-water mark, then fetches one page of --limit rows through the test
+client without buffering. TTFB is the time until the first non-empty chunk
+of the body; "peak +" is how far the request pushed the high-water mark.
+The 10k dataset holds 100,000 shows.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ROUTES = {'shows': '/shows', 'artists': '/artists', 'venues': '/venues'}
+
+
+def run(route, stream, limit):
+    from app import create_app
+
+    app = create_app(STREAM_LISTINGS=stream, MAX_PAGE_SIZE=limit, STREAM_MAX_PAGE_SIZE=limit, CACHE_TYPE='null')
+    app.jinja_env.fragment_cache = None
+    client = app.test_client()
+    client.get(ROUTES[route] + '?limit=1').close()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    response = client.get(ROUTES[route] + '?limit={}'.format(limit), buffered=False)
+    if response.status_code != 200:
+        raise RuntimeError('unexpected status {}'.format(response.status_code))
+    ttfb, size = None, 0
+    for chunk in response.response:
+        if chunk and ttfb is None:
+            ttfb = time.perf_counter() - start
+        size += len(chunk)
+    total = time.perf_counter() - start
+    response.close()
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {'ttfb_ms': round(ttfb * 1000, 3), 'total_ms': round(total * 1000, 3), 'bytes': size,
+            'peak_rss_kb': peak, 'peak_increase_kb': peak - before}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dataset', help='seed venues/artists/shows of this size first (see routes.py)')
+    parser.add_argument('--reset', action='store_true', help='drop and recreate all tables before seeding')
+    parser.add_argument('--limit', type=int, default=5000, help='rows per page')
+    parser.add_argument('--routes', nargs='+', choices=sorted(ROUTES), default=['shows', 'artists', 'venues'])
+    parser.add_argument('--child', nargs=2, metavar=('ROUTE', 'MODE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        route, mode = args.child
+        print(json.dumps(run(route, mode == 'streamed', args.limit)))
+        return
+
+    if args.reset or args.dataset:
+        from app import create_app, db
+        from routes import DATASETS
+        from seed import seed
+        if args.reset:
+            with create_app().app_context():
+                db.drop_all()
+        if args.dataset:
+            seed(*DATASETS[args.dataset])
+
+    report = {}
+    print('{} rows per page'.format(args.limit), file=sys.stderr)
+    print('{:<8} {:<9} {:>10} {:>10} {:>10} {:>12} {:>10}'.format(
+        'route', 'mode', 'TTFB ms', 'total ms', 'KiB', 'peak RSS KiB', 'peak +'), file=sys.stderr)
+    for route in args.routes:
+        for mode in ('buffered', 'streamed'):
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--limit', str(args.limit),
+                                     '--child', route, mode], check=True, stdout=subprocess.PIPE).stdout
+            result = report.setdefault(route, {})[mode] = json.loads(output.decode().splitlines()[-1])
+            print('{:<8} {:<9} {ttfb_ms:>10.2f} {total_ms:>10.2f} {:>10} {peak_rss_kb:>12} {peak_increase_kb:>10}'
+                  .format(route, mode, result['bytes'] // 1024, **result), file=sys.stderr)
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
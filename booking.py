@@ -0,0 +1,137 @@
+"""Show bookings as time intervals.
+
+Every show holds its venue and its artist for ``[start_time, end_time)``.
+``Bookings.overlapping`` returns the shows of one venue or artist that
+overlap a slot: the create form uses it to reject double bookings and the
+availability API to list what is taken in a window.
+
+``RangeBookings`` asks PostgreSQL with ``tsrange && tsrange``, answered by
+the GiST indexes behind the ``ex_Show_venue_slot``/``ex_Show_artist_slot``
+exclusion constraints, which also reject overlapping inserts that race past
+the check. ``MemoryBookings`` is the fallback for other databases: each
+venue's or artist's shows are loaded once into a sorted ``Intervals`` list
+per process and extended by ``record()``.
+"""
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+from sqlalchemy import func
+
+
+class Intervals(object):
+    """Half-open (start, end, id) intervals sorted by start.
+
+    A running maximum of the end times lets ``overlapping`` skip every
+    interval that finished before the query starts, so a lookup costs two
+    bisections plus the intervals it has to look at.
+    """
+
+    def __init__(self, intervals=()):
+        self._items = sorted(tuple(interval) for interval in intervals)
+        self._reindex()
+
+    def _reindex(self):
+        self._starts = [start for start, _, _ in self._items]
+        self._max_ends = []
+        for _, end, _ in self._items:
+            self._max_ends.append(max(end, self._max_ends[-1]) if self._max_ends else end)
+
+    def add(self, start, end, id):
+        insort(self._items, (start, end, id))
+        self._reindex()
+
+    def overlapping(self, start, end):
+        hi = bisect_left(self._starts, end)
+        lo = bisect_right(self._max_ends, start, 0, hi)
+        return [item for item in self._items[lo:hi] if item[1] > start]
+
+    def __len__(self):
+        return len(self._items)
+
+
+def free_slots(booked, start, end):
+    """Gaps between the (id, start, end) bookings inside [start, end)."""
+    slots, cursor = [], start
+    for _, booked_start, booked_end in sorted(booked, key=lambda booking: booking[1]):
+        if booked_start > cursor:
+            slots.append((cursor, min(booked_start, end)))
+        cursor = max(cursor, booked_end)
+        if cursor >= end:
+            break
+    if cursor < end:
+        slots.append((cursor, end))
+    return slots
+
+
+class RangeBookings(object):
+
+    def overlapping(self, column, key, start, end):
+        model = column.class_
+        slot = func.tsrange(model.start_time, model.end_time)
+        return model.query.with_entities(model.id, model.start_time, model.end_time) \
+            .filter(column==key, slot.op('&&')(func.tsrange(start, end))) \
+            .order_by(model.start_time).all()
+
+    def record(self, show):
+        pass
+
+    def invalidate(self):
+        pass
+
+
+class MemoryBookings(object):
+
+    def __init__(self):
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def _index(self, column, key):
+        name = (column.key, key)
+        with self._lock:
+            if name not in self._indexes:
+                model = column.class_
+                rows = model.query.with_entities(model.start_time, model.end_time, model.id).filter(column==key)
+                self._indexes[name] = Intervals(rows)
+            return self._indexes[name]
+
+    def overlapping(self, column, key, start, end):
+        intervals = self._index(column, key)
+        with self._lock:
+            return [(id, booked_start, booked_end)
+                    for booked_start, booked_end, id in intervals.overlapping(start, end)]
+
+    def record(self, show):
+        with self._lock:
+            for name in (('venue_id', show.venue_id), ('artist_id', show.artist_id)):
+                if name in self._indexes:
+                    self._indexes[name].add(show.start_time, show.end_time, show.id)
+
+    def invalidate(self):
+        with self._lock:
+            self._indexes.clear()
+
+
+class Bookings(object):
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('BOOKING_BACKEND', 'auto')
+        backend = app.config['BOOKING_BACKEND']
+        if backend == 'auto':
+            uri = app.config.get('SQLALCHEMY_DATABASE_URI') or ''
+            backend = 'range' if uri.startswith('postgres') else 'memory'
+        self.backend = {'range': RangeBookings, 'memory': MemoryBookings}[backend]()
+        app.extensions['bookings'] = self
+
+    def overlapping(self, column, key, start, end):
+        return self.backend.overlapping(column, key, start, end)
+
+    def record(self, show):
+        self.backend.record(show)
+
+    def invalidate(self):
+        self.backend.invalidate()
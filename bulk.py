@@ -0,0 +1,129 @@
+"""Streaming bulk import and export of table rows as CSV or NDJSON.
+
+Imported rows are validated with the same WTForms classes as the HTML forms
+and inserted with executemany in batches, which the PostgreSQL driver turns
+into multi-row INSERTs. Exports walk the table with ``yield_per`` so only
+one batch is held in memory at a time.
+
+Multi-valued fields (``genres``) are ``;``-separated in CSV and JSON arrays
+in NDJSON.
+"""
+import csv
+import io
+import json
+
+from werkzeug.datastructures import MultiDict
+from wtforms import BooleanField, SelectMultipleField
+
+FORMATS = ('csv', 'ndjson')
+FALSE_VALUES = ('', '0', 'false', 'f', 'no', 'n', 'off')
+
+
+def guess_format(filename, default='csv'):
+    if filename and filename.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    if filename and filename.endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def read_rows(stream, format):
+    # stream is a text file object; yields (line number, dict) pairs
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_num, line in enumerate(stream, 1):
+            if line.strip():
+                yield line_num, json.loads(line)
+
+
+def _fields_of(form_class, kind):
+    return {name for name in dir(form_class) if getattr(getattr(form_class, name), 'field_class', None) is kind}
+
+
+def validate_row(form_class, row):
+    """Validate one raw row with ``form_class``; return (data, errors)."""
+    booleans = _fields_of(form_class, BooleanField)
+    multiples = _fields_of(form_class, SelectMultipleField)
+    formdata = MultiDict()
+    for key, value in row.items():
+        if value is None or value is False:
+            continue
+        if key in booleans:
+            if str(value).strip().lower() not in FALSE_VALUES:
+                formdata[key] = 'y'
+        elif key in multiples:
+            values = value if isinstance(value, list) else [v.strip() for v in value.split(';') if v.strip()]
+            formdata.setlist(key, values)
+        elif value != '':
+            formdata[key] = str(value)
+    form = form_class(formdata=formdata, meta={'csrf': False})
+    for field in form:
+        # a required column missing from the row must not fall back to the
+        # field's default (ShowForm.start_time defaults to now)
+        if field.flags.required and field.name not in formdata:
+            field.data = None
+    if not form.validate():
+        return None, form.errors
+    return form.data, None
+
+
+def import_rows(session, table, form_class, rows, batch_size=1000, prepare=None):
+    """Insert validated ``rows`` into ``table`` in batches of ``batch_size``.
+
+    Invalid rows are skipped and reported; everything else is inserted in
+    one transaction, which is rolled back if any batch fails.
+    """
+    columns = set(table.columns.keys()) - {'id'}
+    inserted, errors, batch = 0, [], []
+    try:
+        for line_num, row in rows:
+            data, row_errors = validate_row(form_class, row)
+            if row_errors:
+                errors.append({'line': line_num, 'errors': row_errors})
+                continue
+            data = {key: value for key, value in data.items() if key in columns}
+            batch.append(prepare(data) if prepare else data)
+            if len(batch) >= batch_size:
+                session.execute(table.insert(), batch)
+                inserted += len(batch)
+                batch = []
+        if batch:
+            session.execute(table.insert(), batch)
+            inserted += len(batch)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return inserted, errors
+
+
+def _serialize(value, format):
+    if format == 'csv':
+        if isinstance(value, list):
+            return ';'.join(value)
+        return '' if value is None else value
+    if hasattr(value, 'isoformat'):
+        return value.isoformat(' ')
+    return value
+
+
+def export_rows(query, columns, format, batch_size=1000):
+    """Yield ``query`` rows encoded as CSV or NDJSON text chunks."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if format == 'csv':
+        writer.writerow(columns)
+    for row in query.yield_per(batch_size):
+        values = [_serialize(value, format) for value in row]
+        if format == 'csv':
+            writer.writerow(values)
+        else:
+            buffer.write(json.dumps(dict(zip(columns, values))) + '\n')
+        if buffer.tell() >= 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,156 @@
+"""Read-through caches for assembled page payloads.
+
+``Cache`` is a small Flask extension in front of a pluggable store: an
+in-process LRU with TTL (``CACHE_TYPE = 'simple'``), a Redis-compatible
+server (``'redis'``, needs the ``redis`` package) or nothing at all
+(``'null'``). Views call ``get_or_set`` with a string key and a function
+that builds the payload; write handlers ``delete`` the keys they affect.
+Stores take an optional per-entry ``ttl`` overriding their default, and
+``get_many`` reads several keys in one round trip.
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class NullStore(object):
+
+    def get(self, key):
+        return None
+
+    def get_many(self, keys):
+        return [None] * len(keys)
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, *keys):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LRUStore(object):
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisStore(object):
+
+    def __init__(self, url, ttl=300, prefix='fyyur:'):
+        if redis is None:
+            raise RuntimeError("CACHE_TYPE = 'redis' needs the redis package")
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        values = self.client.mget([self.prefix + key for key in keys])
+        return [None if value is None else pickle.loads(value) for value in values]
+
+    def set(self, key, value, ttl=None):
+        self.client.setex(self.prefix + key, ttl or self.ttl, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+class Cache(object):
+
+    def __init__(self, app=None):
+        self.store = NullStore()
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_TYPE', 'simple')
+        app.config.setdefault('CACHE_DEFAULT_TIMEOUT', 300)
+        app.config.setdefault('CACHE_MAXSIZE', 1024)
+        app.config.setdefault('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+        self.store = self.create_store(app.config)
+        app.extensions['cache'] = self
+
+    @staticmethod
+    def create_store(config):
+        kind = config['CACHE_TYPE']
+        if kind == 'simple':
+            return LRUStore(config['CACHE_MAXSIZE'], config['CACHE_DEFAULT_TIMEOUT'])
+        if kind == 'redis':
+            return RedisStore(config['CACHE_REDIS_URL'], config['CACHE_DEFAULT_TIMEOUT'])
+        return NullStore()
+
+    def get_or_set(self, key, build):
+        # None is never cached, so missing rows keep hitting the database
+        value = self.store.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = build()
+        if value is not None:
+            self.store.set(key, value)
+        return value
+
+    def delete(self, *keys):
+        self.store.delete(*keys)
+
+    def clear(self):
+        self.store.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,68 @@
+"""Month grids and iCalendar (RFC 5545) feeds for show listings."""
+import calendar
+from datetime import MAXYEAR, MINYEAR, datetime, timedelta
+
+
+def month_bounds(value=None):
+    """First moment of the ``YYYY-MM`` month (the current one by default) and of the next.
+
+    Raises ValueError for a malformed month, or one whose calendar page would
+    reach past the years ``datetime`` can represent.
+    """
+    if value:
+        first = datetime.strptime(value, '%Y-%m')
+        if not MINYEAR < first.year < MAXYEAR:
+            raise ValueError('month out of range: {}'.format(value))
+    else:
+        first = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return first, (first + timedelta(days=32)).replace(day=1)
+
+
+def month_weeks(first):
+    # Monday-first weeks covering the month, padded with days of the
+    # neighbouring months.
+    return calendar.Calendar().monthdatescalendar(first.year, first.month)
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _fold(line):
+    # Content lines are limited to 75 octets; continuations start with a space.
+    parts, current, size = [], '', 0
+    for char in line:
+        width = len(char.encode('utf-8'))
+        if size + width > 75:
+            parts.append(current)
+            current, size = ' ', 1
+        current += char
+        size += width
+    parts.append(current)
+    return '\r\n'.join(parts)
+
+
+def _timestamp(value):
+    # Show times are stored without a zone, so they go out as floating local times.
+    return value.strftime('%Y%m%dT%H%M%S')
+
+
+def ics_feed(name, events, host='fyyur'):
+    """Render ``events`` (dicts with id, start, end, summary, location, url) as a VCALENDAR."""
+    stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//Fyyur//Shows//EN', 'CALSCALE:GREGORIAN',
+             'X-WR-CALNAME:' + _escape(name)]
+    for event in events:
+        lines += ['BEGIN:VEVENT',
+                  'UID:show-{}@{}'.format(event['id'], host),
+                  'DTSTAMP:' + stamp,
+                  'DTSTART:' + _timestamp(event['start']),
+                  'DTEND:' + _timestamp(event['end']),
+                  'SUMMARY:' + _escape(event['summary'])]
+        if event.get('location'):
+            lines.append('LOCATION:' + _escape(event['location']))
+        if event.get('url'):
+            lines.append('URL:' + event['url'])
+        lines.append('END:VEVENT')
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(_fold(line) for line in lines) + '\r\n'
@@ -1,15 +1,170 @@
 import os
-SECRET_KEY = os.urandom(32)
+SECRET_KEY = os.environ.get('SECRET_KEY') or os.urandom(32)
 # Grabs the folder where the script runs.
 basedir = os.path.abspath(os.path.dirname(__file__))
 
-# Enable debug mode.
-DEBUG = True
+# Enable debug mode with FLASK_DEBUG=1 or FLASK_ENV=development.
+DEBUG = os.environ.get('FLASK_DEBUG', '1' if os.environ.get('FLASK_ENV') == 'development' else '0') == '1'
 
 # Connect to the database
 
-SQLALCHEMY_DATABASE_URI = 'postgres://postgres@localhost:5432/fyyur'
+SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgresql://postgres@localhost:5432/fyyur')
+if SQLALCHEMY_DATABASE_URI.startswith('postgres://'):
+    SQLALCHEMY_DATABASE_URI = 'postgresql://' + SQLALCHEMY_DATABASE_URI[len('postgres://'):]
+
+# Connection pool, per worker process. Keep
+#   workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) * (1 + replicas)
+#   + workers * (ASYNC_POOL_SIZE + ASYNC_MAX_OVERFLOW) + JOBS_WORKERS
+# below the server's max_connections; `flask check-db` reports both.
+
+SQLALCHEMY_ENGINE_OPTIONS = {}
+if SQLALCHEMY_DATABASE_URI.startswith('postgresql'):
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 5)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') == '1',
+        'connect_args': {
+            'options': '-c statement_timeout={}'.format(int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 5000))),
+        },
+    }
+
+# Read replicas for GET and search requests, comma-separated in DATABASE_REPLICA_URLS
+
+SQLALCHEMY_REPLICA_URIS = [uri.strip() for uri in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if uri.strip()]
+REPLICA_CHECK_INTERVAL = 5
+REPLICA_MAX_LAG = 10
+REPLICA_STICKY_SECONDS = 5
 
 # Silence warning
 
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# Number of shows per page on /shows
+
+SHOWS_PER_PAGE = 30
+
+# Page sizes for /venues and /artists; ?limit= is clamped to MAX_PAGE_SIZE.
+# Their totals come from the planner's pg_class.reltuples estimate once a
+# table holds more than EXACT_COUNT_THRESHOLD rows.
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+EXACT_COUNT_THRESHOLD = 10000
+
+# Stream /shows, /artists and /venues: rows are fetched STREAM_BATCH_SIZE at
+# a time through a server-side cursor and rendered as they arrive, sent in
+# chunks of STREAM_BUFFER_SIZE bytes. Pages may then hold up to
+# STREAM_MAX_PAGE_SIZE rows.
+
+STREAM_LISTINGS = os.environ.get('STREAM_LISTINGS', '0') == '1'
+STREAM_BATCH_SIZE = 500
+STREAM_BUFFER_SIZE = 16 * 1024
+STREAM_MAX_PAGE_SIZE = 5000
+
+# Name search backend: 'trigram' (PostgreSQL pg_trgm), 'memory' or 'auto'
+
+SEARCH_BACKEND = 'auto'
+SEARCH_RESULT_LIMIT = 50  # results per page
+SEARCH_COUNT_LIMIT = 1000  # totals above this are shown as "1000+"
+
+# Values listed per facet (state, city, genre, seeking) on the listing and
+# search pages, most common first
+
+FACET_VALUE_LIMIT = 20
+
+# Cache for assembled venue/artist detail pages: 'simple' (in-process LRU),
+# 'redis' or 'null'. Entries are dropped on writes and expire after the
+# timeout, which also bounds how late a show moves from upcoming to past.
+# A write only drops the entries of the process that handled it, so 'simple'
+# is for the single-process dev server; `flask check-db --workers N` and the
+# gunicorn startup check refuse it for more than one worker. Without
+# CACHE_TYPE nothing is cached outside debug mode.
+
+CACHE_TYPE = os.environ.get('CACHE_TYPE', 'simple' if DEBUG else 'null')
+CACHE_DEFAULT_TIMEOUT = 300
+CACHE_MAXSIZE = 1024
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+
+# Store for {% cache %} template fragments (show tiles, venue areas); same
+# choices as CACHE_TYPE. Keys are versioned, so entries only need to expire
+# to bound how late a show moves from upcoming to past.
+
+FRAGMENT_CACHE_TYPE = os.environ.get('FRAGMENT_CACHE_TYPE', CACHE_TYPE)
+FRAGMENT_CACHE_DEFAULT_TIMEOUT = 300
+FRAGMENT_CACHE_MAXSIZE = 20000
+
+# Static bundles (assets.py) are built by `flask build-assets`, which the
+# Procfile runs before gunicorn starts. Outside debug mode the gunicorn startup
+# check refuses to serve without them.
+
+ASSETS_BUNDLED = os.environ.get('ASSETS_BUNDLED', '0' if DEBUG else '1') == '1'
+
+# Request instrumentation served from /_metrics
+
+METRICS_QUERY_COUNT_HEADER = False
+METRICS_SLOW_QUERY_THRESHOLD = 0.1
+
+# Rows per INSERT batch / export fetch for bulk import and export
+
+BULK_BATCH_SIZE = 1000
+
+# POST /<kind>/import is for scripts, not browsers: it skips the CSRF check
+# and instead needs "Authorization: Bearer <IMPORT_API_TOKEN>". Without a
+# token it is disabled; `flask import` works either way.
+
+IMPORT_API_TOKEN = os.environ.get('IMPORT_API_TOKEN') or None
+
+# Image proxy for venue/artist images (thumbnails.py, needs Pillow). Every
+# image_link is fetched once and resized to each preset (max width, height)
+# by a background job, which must see the same THUMBNAIL_CACHE_DIR.
+# Thumbnail URLs are signed with THUMBNAIL_SIGNING_KEY, which must be the same
+# in every process and across restarts; the gunicorn startup check refuses to
+# run without it. The dev server falls back to the per-process SECRET_KEY.
+
+THUMBNAIL_SIGNING_KEY = os.environ.get('THUMBNAIL_SIGNING_KEY') or None
+THUMBNAIL_CACHE_DIR = os.environ.get('THUMBNAIL_CACHE_DIR', os.path.join(basedir, 'instance', 'thumbnails'))
+THUMBNAIL_CACHE_MAX_BYTES = int(os.environ.get('THUMBNAIL_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+THUMBNAIL_SIZES = {'tile': (600, 400), 'detail': (1200, 1000)}
+THUMBNAIL_QUALITY = 80
+
+# Every show holds its venue and artist for this long; overlapping bookings
+# are rejected. 'range' uses PostgreSQL tsrange exclusion constraints,
+# 'memory' a per-process interval index, 'auto' picks by database.
+
+SHOW_DURATION_MINUTES = 180
+BOOKING_BACKEND = 'auto'
+BOOKING_MAX_WINDOW_DAYS = 92
+
+# iCalendar feeds (/venues/<id>/shows.ics, /artists/<id>/shows.ics)
+
+FEED_MAX_WINDOW_DAYS = 800
+FEED_MAX_AGE = 3600
+
+# Background jobs (jobs.py) run in `flask run-jobs`, the Procfile's worker,
+# with JOBS_WORKERS threads. JOBS_IN_PROCESS=1 runs the threads inside every
+# web process instead, e.g. for the dev server. Finished jobs stay in the table
+# for JOBS_KEEP_FINISHED seconds, which is the window /_metrics reports on.
+
+JOBS_IN_PROCESS = os.environ.get('JOBS_IN_PROCESS', '0') == '1'
+JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS', 2))
+JOBS_POLL_INTERVAL = 1.0
+JOBS_MAX_ATTEMPTS = 5
+JOBS_RETRY_BACKOFF = 10
+JOBS_TIMEOUT = 300
+JOBS_KEEP_FINISHED = 3600
+LINK_CHECK_TIMEOUT = 5
+
+# Venue/Artist upcoming show counters are rolled over by `flask rollover-shows`;
+# run it from cron every few minutes, e.g.
+#   */5 * * * * cd /srv/fyyur && FLASK_APP=app flask rollover-shows
+
+# Optional asyncio engine (e.g. 'postgresql+asyncpg://postgres@localhost:5432/fyyur')
+# used to run a view's independent queries concurrently. Its statements are
+# counted by /_metrics but are not routed to SQLALCHEMY_REPLICA_URIS; point it
+# at a replica to take those reads off the primary.
+
+ASYNC_DATABASE_URI = os.environ.get('ASYNC_DATABASE_URI') or None
+ASYNC_POOL_SIZE = 10
+ASYNC_MAX_OVERFLOW = 10
@@ -1,3 +1,4 @@
+import os
 from fabric.api import local, settings, abort
 from fabric.contrib.console import confirm
 
@@ -6,13 +7,20 @@ from fabric.contrib.console import confirm
 
 def test():
     with settings(warn_only=True):
-        result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
-        )
+        result = local("python -m pytest -q", capture=True)
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
 
 
+def bench(baseline="benchmarks/baseline.json"):
+    # Compare against a saved report when there is one; copy report.json to
+    # baseline.json to make a run the new reference.
+    command = "python benchmarks/routes.py --output benchmarks/report.json"
+    if os.path.exists(baseline):
+        command += " --baseline {}".format(baseline)
+    local(command)
+
+
 def commit():
     message = raw_input("Enter a git commit message: ")
     local("git add . && git commit -am '{}'".format(message))
@@ -0,0 +1,179 @@
+"""Faceted filtering of the venue and artist listings.
+
+``register(model, state=model.state, ...)`` names the columns a listing
+can be narrowed by, once at import time for every app. ``selected(model, args)`` picks the facets
+present in the query string (``?state=CA&genre=Jazz&seeking=yes``) and
+``criteria`` turns them into filters: equality for plain columns, ``yes`` or
+``no`` for booleans, and ``genres @> ARRAY[...]`` for array columns, which
+PostgreSQL answers from the GIN indexes on ``genres`` (SQLite, which keeps
+them as JSON, searches them with ``json_each``).
+
+How many rows carry each value is kept in the ``Facet`` table (model, facet,
+value, count), so the sidebar reads a few rows instead of grouping the whole
+table on every request. Write handlers keep it current in their own
+transaction: ``add``/``remove`` for created and deleted rows, ``values``
+before and ``apply`` after an edit, which upserts ``count = count + delta``
+for the values that changed. ``rebuild`` recounts a model from scratch after
+bulk imports and in ``flask rebuild-facets``. The counts are over the whole
+table; they are not narrowed by the other selected facets.
+"""
+from collections import Counter
+
+import sqlalchemy as sa
+from flask import abort, request, url_for
+from sqlalchemy.dialects import postgresql, sqlite
+
+UPSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+# {table name: {facet: column}}
+COLUMNS = {}
+
+
+def register(model, **columns):
+    COLUMNS[model.__tablename__] = columns
+
+
+def _split(value):
+    # Every value a row contributes to one facet.
+    if value is None or value == '':
+        return ()
+    if isinstance(value, bool):
+        return ('yes' if value else 'no',)
+    if isinstance(value, (list, tuple)):
+        return sorted(set(item for item in value if item))
+    return (value,)
+
+
+class Facets(object):
+
+    def __init__(self, app=None, db=None):
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('FACET_VALUE_LIMIT', 20)
+        self.db = db
+        self.value_limit = app.config['FACET_VALUE_LIMIT']
+        self.table = db.metadata.tables.get('Facet')
+        if self.table is None:
+            self.table = db.Table(
+                'Facet',
+                sa.Column('model', sa.String(40), primary_key=True),
+                sa.Column('facet', sa.String(40), primary_key=True),
+                sa.Column('value', sa.String(120), primary_key=True),
+                sa.Column('count', sa.Integer, nullable=False, server_default='0'),
+            )
+        app.jinja_env.globals['facet_url'] = self.url
+        app.extensions['facets'] = self
+
+    def selected(self, model, args):
+        """The registered facets present in ``args``, as {facet: value}.
+
+        Aborts with 400 when a boolean facet is anything but ``yes`` or ``no``.
+        """
+        columns = COLUMNS[model.__tablename__]
+        selected = {facet: args[facet] for facet in columns if args.get(facet)}
+        for facet, value in selected.items():
+            if isinstance(columns[facet].type, sa.Boolean) and value not in ('yes', 'no'):
+                abort(400)
+        return selected
+
+    def url(self, facet, value=None):
+        # The current page, from its start, with facet set to value or cleared.
+        args = {key: arg for key, arg in request.values.items() if key not in ('after', 'csrf_token', facet)}
+        if value is not None:
+            args[facet] = value
+        return url_for(request.endpoint, **dict(request.view_args or {}, **args))
+
+    def criteria(self, model, selected):
+        columns = COLUMNS[model.__tablename__]
+        criteria = []
+        for facet, value in sorted(selected.items()):
+            column = columns[facet]
+            if isinstance(column.type, sa.ARRAY):
+                criteria.append(self._contains(column, value))
+            elif isinstance(column.type, sa.Boolean):
+                criteria.append(column.is_(value == 'yes'))
+            else:
+                criteria.append(column==value)
+        return criteria
+
+    def _contains(self, column, value):
+        # column @> ARRAY[value]; SQLite stores the array as JSON instead.
+        if self.db.engine.dialect.name == 'sqlite':
+            items = sa.func.json_each(column).table_valued('value')
+            return sa.exists().where(items.c.value==value)
+        return column.op('@>')(sa.cast(postgresql.array([value]), column.type))
+
+    def values(self, model, row):
+        """Counter of the (facet, value) pairs of a model instance or row."""
+        found = Counter()
+        for facet, column in COLUMNS[model.__tablename__].items():
+            for value in _split(getattr(row, column.key)):
+                found[(facet, value)] += 1
+        return found
+
+    def apply(self, model, before, after):
+        """Move the counts from the ``before`` values to the ``after`` ones."""
+        delta = Counter(after)
+        delta.subtract(before)
+        # sorted, so concurrent writers lock the rows in the same order
+        rows = [{'model': model.__tablename__, 'facet': facet, 'value': value, 'count': count}
+                for (facet, value), count in sorted(delta.items()) if count]
+        if rows:
+            self._upsert(rows)
+
+    def add(self, model, row):
+        self.apply(model, Counter(), self.values(model, row))
+
+    def remove(self, model, row):
+        self.apply(model, self.values(model, row), Counter())
+
+    def _upsert(self, rows):
+        t = self.table
+        session = self.db.session
+        insert = UPSERTS.get(self.db.engine.dialect.name)
+        if insert is not None:
+            statement = insert(t).values(rows)
+            session.execute(statement.on_conflict_do_update(
+                index_elements=[t.c.model, t.c.facet, t.c.value], set_={'count': t.c.count + statement.excluded.count}))
+            return
+        for row in rows:
+            updated = session.execute(
+                t.update().where(t.c.model==row['model'], t.c.facet==row['facet'], t.c.value==row['value'])
+                .values(count=t.c.count + row['count']))
+            if not updated.rowcount:
+                session.execute(t.insert().values(**row))
+
+    def rebuild(self, model, batch_size=1000):
+        """Recount every facet of ``model`` in the current transaction."""
+        columns = COLUMNS[model.__tablename__]
+        counts = Counter()
+        for row in model.query.with_entities(*columns.values()).yield_per(batch_size):
+            counts.update(self.values(model, row))
+        t = self.table
+        session = self.db.session
+        session.execute(t.delete().where(t.c.model==model.__tablename__))
+        rows = [{'model': model.__tablename__, 'facet': facet, 'value': value, 'count': count}
+                for (facet, value), count in sorted(counts.items())]
+        for start in range(0, len(rows), batch_size):
+            session.execute(t.insert(), rows[start:start + batch_size])
+
+    def counts(self, model):
+        """{facet: [(value, count), ...]}, the FACET_VALUE_LIMIT most common values of each."""
+        t = self.table
+        rank = sa.func.row_number().over(partition_by=t.c.facet, order_by=(t.c.count.desc(), t.c.value)).label('rank')
+        ranked = sa.select(t.c.facet, t.c.value, t.c.count, rank) \
+            .where(t.c.model==model.__tablename__, t.c.count > 0).subquery()
+        rows = self.db.session.execute(
+            sa.select(ranked.c.facet, ranked.c.value, ranked.c.count)
+            .where(ranked.c.rank <= self.value_limit).order_by(ranked.c.facet, ranked.c.rank))
+        counts = {facet: [] for facet in COLUMNS[model.__tablename__]}
+        for facet, value, count in rows:
+            if facet in counts:
+                counts[facet].append((value, count))
+        return counts
+
+    def count(self, model, facet, value):
+        t = self.table
+        return self.db.session.query(t.c.count).filter(
+            t.c.model==model.__tablename__, t.c.facet==facet, t.c.value==value).scalar() or 0
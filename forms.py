@@ -1,6 +1,6 @@
 from datetime import datetime
 from flask_wtf import FlaskForm
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, IntegerField
 from wtforms.validators import DataRequired, AnyOf, URL, Regexp, Optional
 
 
@@ -99,12 +99,12 @@ SEEK_DESC = StringField('seeking_description')
 
 
 class ShowForm(FlaskForm):
-    artist_id = StringField('artist_id', validators=[DataRequired(), Regexp(r'\d+')])
-    venue_id = StringField('venue_id', validators=[DataRequired(), Regexp(r'\d+')])
+    artist_id = IntegerField('artist_id', validators=[DataRequired()])
+    venue_id = IntegerField('venue_id', validators=[DataRequired()])
     start_time = DateTimeField(
         'start_time',
         validators=[DataRequired()],
-        default= datetime.today()
+        default=datetime.today
     )
 
 class VenueForm(FlaskForm):
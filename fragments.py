@@ -0,0 +1,109 @@
+"""Cached template fragments.
+
+``FragmentCache`` adds a ``{% cache key, ttl %}...{% endcache %}`` tag to
+Jinja. The rendered body is kept in its own store (any of the cache.py
+stores, picked by ``FRAGMENT_CACHE_TYPE``) under ``key``, a string or a list
+of parts joined with ``:``; ``ttl`` is optional and defaults to
+``FRAGMENT_CACHE_DEFAULT_TIMEOUT``.
+
+Keys carry versions rather than being deleted one by one: templates mix
+``fragment_version('venue:3', ...)`` into the key, and write handlers call
+``invalidate('venue:3')`` to give that name a new random version, which
+orphans every fragment rendered from the old one until it expires. All the
+names of one call are read in a single ``get_many``; where the rows already
+loaded carry a version (``Venue.version``, ``Artist.version``), keying on
+that costs no store round trip at all.
+"""
+import os
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from cache import Cache
+
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', args), [], [], body).set_lineno(lineno)
+
+    def _render(self, key, ttl, caller):
+        fragments = self.environment.fragment_cache
+        if fragments is None:
+            return caller()
+        return fragments.get_or_render(key, ttl, caller)
+
+
+class FragmentCache(object):
+
+    def __init__(self, app=None):
+        self.store = None
+        self.version_ttl = None
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FRAGMENT_CACHE_TYPE', app.config.get('CACHE_TYPE', 'simple'))
+        app.config.setdefault('FRAGMENT_CACHE_DEFAULT_TIMEOUT', 3600)
+        app.config.setdefault('FRAGMENT_CACHE_MAXSIZE', 20000)
+        self.store = Cache.create_store({
+            'CACHE_TYPE': app.config['FRAGMENT_CACHE_TYPE'],
+            'CACHE_DEFAULT_TIMEOUT': app.config['FRAGMENT_CACHE_DEFAULT_TIMEOUT'],
+            'CACHE_MAXSIZE': app.config['FRAGMENT_CACHE_MAXSIZE'],
+            'CACHE_REDIS_URL': app.config.get('CACHE_REDIS_URL', 'redis://localhost:6379/0'),
+        })
+        # versions must outlive the fragments keyed on them
+        self.version_ttl = app.config['FRAGMENT_CACHE_DEFAULT_TIMEOUT'] * 24
+        app.jinja_env.add_extension(FragmentCacheExtension)
+        app.jinja_env.fragment_cache = self
+        app.jinja_env.globals['fragment_version'] = self.version
+        app.extensions['fragments'] = self
+
+    def version(self, *names):
+        # A missing version gets a fresh one, never a default, so fragments
+        # rendered before it was evicted can't come back.
+        keys = ['version:' + name for name in names]
+        versions = self.store.get_many(keys)
+        for i, value in enumerate(versions):
+            if value is None:
+                versions[i] = os.urandom(4).hex()
+                self.store.set(keys[i], versions[i], self.version_ttl)
+        return '.'.join(versions)
+
+    def invalidate(self, *names):
+        for name in names:
+            self.store.set('version:' + name, os.urandom(4).hex(), self.version_ttl)
+
+    def get_or_render(self, key, ttl, render):
+        if isinstance(key, (list, tuple)):
+            key = ':'.join(str(part) for part in key)
+        key = 'fragment:' + key
+        value = self.store.get(key)
+        if value is not None:
+            self.hits += 1
+            return Markup(value)
+        self.misses += 1
+        value = render()
+        self.store.set(key, str(value), ttl)
+        return Markup(value)
+
+    def clear(self):
+        self.store.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,43 @@
+# Gunicorn settings for production, all overridable from the environment.
+#
+#   $ gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Each worker process gets its own SQLAlchemy pools (see SQLALCHEMY_ENGINE_OPTIONS
+# in config.py), so the database must accept WEB_CONCURRENCY times the primary,
+# replica and async pools, plus the job workers' connections; the check in
+# when_ready() refuses to start otherwise, without the built asset bundles, or
+# without a THUMBNAIL_SIGNING_KEY.
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:{}'.format(os.environ.get('PORT', 8000)))
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = timeout
+keepalive = 5
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+preload_app = True
+accesslog = '-'
+
+
+def when_ready(server):
+    from app import check_assets, check_database, check_thumbnails
+    from wsgi import app
+    problems = check_database(app, server.cfg.workers) + check_assets(app) + check_thumbnails(app)
+    for problem in problems:
+        server.log.error('Startup check failed: %s', problem)
+    if problems:
+        raise SystemExit(1)
+
+
+def post_fork(server, worker):
+    # The preloaded app may have opened connections in the master; the child
+    # must not share those sockets, so drop them without closing.
+    from app import db, aio, replicas
+    from wsgi import app
+    with app.app_context():
+        db.engine.dispose(close=False)
+        aio.dispose()
+        replicas.dispose()
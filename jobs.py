@@ -0,0 +1,220 @@
+"""Background jobs for work that does not have to finish inside the request.
+
+Jobs are rows in the ``Job`` table of the application database, so a job
+enqueued by a write handler commits or rolls back together with the write.
+``JobQueue.enqueue(name, **payload)`` adds the row to the current session;
+functions registered with ``@task`` run it with the JSON payload as keyword
+arguments. Tasks are registered at import time and shared by every app; the
+queue itself, its settings and its worker threads belong to one app.
+
+Workers are threads that claim one job at a time with a single
+``UPDATE ... RETURNING`` (``FOR UPDATE SKIP LOCKED`` on PostgreSQL, so any
+number of processes can share the table). A failing job is retried after
+``JOBS_RETRY_BACKOFF * 2 ** (attempts - 1)`` seconds until it has been tried
+``JOBS_MAX_ATTEMPTS`` times, then kept with status ``failed``; one left
+``running`` by a dead worker for ``JOBS_TIMEOUT`` seconds is claimed again.
+Finished jobs are kept with status ``done`` and their ``finished_at`` for
+``JOBS_KEEP_FINISHED`` seconds, then deleted.
+
+``collect`` reports the queue from the table rather than from counters in
+the worker, so every web process's ``/_metrics`` sees the jobs run by
+``flask run-jobs``: the depth by status, the age of the oldest ready job and
+the count and mean wait and run times of the recently finished ones.
+
+With ``JOBS_IN_PROCESS`` each web process starts ``JOBS_WORKERS`` threads on
+its first enqueue; otherwise ``flask run-jobs`` runs dedicated workers.
+"""
+import json
+import os
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+
+TASKS = {}
+
+
+def task(function):
+    TASKS[function.__name__] = function
+    return function
+
+
+def _wake_after_commit(session):
+    # One listener for every app: enqueue() leaves its queue in session.info.
+    queue = session.info.pop('jobs_enqueued', None)
+    if queue is not None:
+        queue._wake.set()
+
+
+class JobQueue(object):
+
+    def __init__(self, app=None, db=None):
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('JOBS_IN_PROCESS', False)
+        app.config.setdefault('JOBS_WORKERS', 2)
+        app.config.setdefault('JOBS_POLL_INTERVAL', 1.0)
+        app.config.setdefault('JOBS_MAX_ATTEMPTS', 5)
+        app.config.setdefault('JOBS_RETRY_BACKOFF', 10)
+        app.config.setdefault('JOBS_TIMEOUT', 300)
+        app.config.setdefault('JOBS_KEEP_FINISHED', 3600)
+        self.app = app
+        self.db = db
+        self.in_process = app.config['JOBS_IN_PROCESS']
+        self.workers = app.config['JOBS_WORKERS']
+        self.poll_interval = app.config['JOBS_POLL_INTERVAL']
+        self.max_attempts = app.config['JOBS_MAX_ATTEMPTS']
+        self.backoff = app.config['JOBS_RETRY_BACKOFF']
+        self.timeout = app.config['JOBS_TIMEOUT']
+        self.keep_finished = app.config['JOBS_KEEP_FINISHED']
+        self.table = db.metadata.tables.get('Job')
+        if self.table is None:
+            self.table = db.Table(
+                'Job',
+                sa.Column('id', sa.Integer, primary_key=True),
+                sa.Column('name', sa.String(120), nullable=False),
+                sa.Column('payload', sa.Text, nullable=False),
+                sa.Column('status', sa.String(10), nullable=False, server_default='queued'),
+                sa.Column('attempts', sa.Integer, nullable=False, server_default='0'),
+                sa.Column('run_at', sa.DateTime, nullable=False),
+                sa.Column('created_at', sa.DateTime, nullable=False),
+                sa.Column('started_at', sa.DateTime),
+                sa.Column('finished_at', sa.DateTime),
+                sa.Column('last_error', sa.Text),
+                sa.Index('ix_Job_status_run_at', 'status', 'run_at'),
+            )
+        if not sa.event.contains(db.session, 'after_commit', _wake_after_commit):
+            sa.event.listen(db.session, 'after_commit', _wake_after_commit)
+        app.extensions['jobs'] = self
+
+    def enqueue(self, name, delay=0, **payload):
+        """Add a job to the current transaction; it becomes visible on commit."""
+        if name not in TASKS:
+            raise KeyError('unknown job {!r}'.format(name))
+        now = datetime.utcnow()
+        session = self.db.session
+        session.execute(self.table.insert().values(
+            name=name, payload=json.dumps(payload), status='queued', attempts=0,
+            run_at=now + timedelta(seconds=delay), created_at=now))
+        session.info['jobs_enqueued'] = self
+        if self.in_process:
+            self.start()
+
+    def _claim(self, connection):
+        t = self.table
+        now = datetime.utcnow()
+        ready = sa.or_(sa.and_(t.c.status=='queued', t.c.run_at<=now),
+                       sa.and_(t.c.status=='running', t.c.started_at<now - timedelta(seconds=self.timeout)))
+        next_id = sa.select(t.c.id).where(ready).order_by(t.c.run_at).limit(1) \
+            .with_for_update(skip_locked=True).scalar_subquery()
+        return connection.execute(
+            t.update().where(t.c.id==next_id)
+            .values(status='running', started_at=now, attempts=t.c.attempts + 1)
+            .returning(t.c.id, t.c.name, t.c.payload, t.c.attempts, t.c.run_at, t.c.started_at)
+        ).first()
+
+    def run_once(self):
+        """Claim and run one job; returns False when none is ready."""
+        with self.db.engine.begin() as connection:
+            job = self._claim(connection)
+        if job is None:
+            return False
+        t = self.table
+        try:
+            TASKS[job.name](**json.loads(job.payload))
+        except Exception:
+            self.db.session.rollback()
+            self.app.logger.exception('Job %s (%s) failed, attempt %d', job.id, job.name, job.attempts)
+            if job.attempts >= self.max_attempts:
+                values = {'status': 'failed'}
+            else:
+                values = {'status': 'queued', 'run_at': datetime.utcnow()
+                          + timedelta(seconds=self.backoff * 2 ** (job.attempts - 1))}
+            values['last_error'] = traceback.format_exc()
+            with self.db.engine.begin() as connection:
+                connection.execute(t.update().where(t.c.id==job.id).values(**values))
+        else:
+            now = datetime.utcnow()
+            with self.db.engine.begin() as connection:
+                connection.execute(t.update().where(t.c.id==job.id).values(status='done', finished_at=now))
+                connection.execute(t.delete().where(
+                    t.c.status=='done', t.c.finished_at<now - timedelta(seconds=self.keep_finished)))
+        finally:
+            self.db.session.remove()
+        return True
+
+    def _work(self):
+        with self.app.app_context():
+            while not self._stop.is_set():
+                self._wake.clear()
+                try:
+                    ran = self.run_once()
+                except sa.exc.SQLAlchemyError:
+                    self.app.logger.exception('Could not claim a job')
+                    ran = False
+                if not ran:
+                    self._wake.wait(self.poll_interval)
+
+    def start(self, workers=None):
+        # Once per process: a forked gunicorn worker starts its own threads.
+        with self._lock:
+            if self._pid == os.getpid():
+                return []
+            self._pid = os.getpid()
+            self._stop.clear()
+            threads = [threading.Thread(target=self._work, name='fyyur-jobs-{}'.format(i), daemon=True)
+                       for i in range(workers or self.workers)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self._pid = None
+
+    def _seconds(self, later, earlier):
+        if self.db.engine.dialect.name == 'sqlite':
+            return (sa.func.julianday(later) - sa.func.julianday(earlier)) * 86400
+        return sa.extract('epoch', later - earlier)
+
+    def stats(self):
+        t = self.table
+        session = self.db.session
+        now = datetime.utcnow()
+        counts = dict(session.query(t.c.status, sa.func.count()).filter(t.c.status!='done')
+                      .group_by(t.c.status).all())
+        oldest = session.query(sa.func.min(t.c.run_at)).filter(t.c.status=='queued', t.c.run_at<=now).scalar()
+        finished, wait, run = session.query(
+            sa.func.count(), sa.func.avg(self._seconds(t.c.started_at, t.c.run_at)),
+            sa.func.avg(self._seconds(t.c.finished_at, t.c.started_at)),
+        ).filter(t.c.status=='done', t.c.finished_at>=now - timedelta(seconds=self.keep_finished)).one()
+        return {
+            'queued': counts.get('queued', 0),
+            'running': counts.get('running', 0),
+            'failed': counts.get('failed', 0),
+            'oldest_queued_seconds': (now - oldest).total_seconds() if oldest else 0,
+            'finished': finished,
+            'wait_seconds': max(float(wait or 0), 0),
+            'run_seconds': float(run or 0),
+        }
+
+    def collect(self):
+        stats = self.stats()
+        return [
+            ('jobs_queued', 'gauge', 'Jobs waiting to run', stats['queued']),
+            ('jobs_running', 'gauge', 'Jobs claimed by a worker', stats['running']),
+            ('jobs_failed', 'gauge', 'Jobs that ran out of attempts', stats['failed']),
+            ('jobs_oldest_queued_seconds', 'gauge', 'How long the oldest ready job has waited',
+             stats['oldest_queued_seconds']),
+            ('jobs_finished', 'gauge', 'Jobs finished within JOBS_KEEP_FINISHED', stats['finished']),
+            ('jobs_wait_seconds', 'gauge', 'Mean time those jobs spent queued', stats['wait_seconds']),
+            ('jobs_run_seconds', 'gauge', 'Mean time those jobs spent running', stats['run_seconds']),
+        ]
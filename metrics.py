@@ -0,0 +1,140 @@
+"""Per-request SQL and render instrumentation.
+
+``Metrics`` hooks the cursor events of the engines handed to ``instrument``
+and Flask's request and template signals to record, per endpoint, how many statements a view issued and how
+long it spent in the database, in template rendering and overall. Totals are
+served in the Prometheus text format from ``/_metrics`` and the slowest
+statements are sampled to ``/_metrics/slow``. Setting
+``METRICS_QUERY_COUNT_HEADER`` adds an ``X-Query-Count`` header to every
+buffered response. Streamed responses are counted once their body has been
+sent, so they go without the header.
+"""
+import threading
+import time
+from collections import defaultdict, deque
+
+from flask import Response, g, has_request_context, jsonify, request
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+
+FIELDS = [
+    ('requests', 'counter', 'Requests handled'),
+    ('db_queries', 'counter', 'SQL statements executed'),
+    ('db_seconds', 'counter', 'Time spent executing SQL statements'),
+    ('render_seconds', 'counter', 'Time spent rendering templates'),
+    ('request_seconds', 'counter', 'Time spent handling requests'),
+]
+
+
+class Metrics(object):
+
+    def __init__(self, app=None):
+        self.endpoints = defaultdict(lambda: dict.fromkeys([name for name, _, _ in FIELDS], 0))
+        self.collectors = []
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_QUERY_COUNT_HEADER', False)
+        app.config.setdefault('METRICS_SLOW_QUERY_THRESHOLD', 0.1)
+        app.config.setdefault('METRICS_SLOW_QUERY_SAMPLES', 50)
+        self.slow_threshold = app.config['METRICS_SLOW_QUERY_THRESHOLD']
+        self.slow_queries = deque(maxlen=app.config['METRICS_SLOW_QUERY_SAMPLES'])
+        self.query_count_header = app.config['METRICS_QUERY_COUNT_HEADER']
+
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule('/_metrics', 'metrics', self.export)
+        app.add_url_rule('/_metrics/slow', 'slow_queries', self.export_slow)
+        app.extensions['metrics'] = self
+
+    def instrument(self, engine):
+        # Count the statements of engine, once however many apps share it.
+        for name, listener in (('before_cursor_execute', self._before_cursor_execute),
+                               ('after_cursor_execute', self._after_cursor_execute)):
+            if not event.contains(engine, name, listener):
+                event.listen(engine, name, listener)
+
+    def add_collector(self, collect):
+        # collect() returns (name, type, help, value) tuples added to /_metrics
+        if collect not in self.collectors:
+            self.collectors.append(collect)
+
+    def _current(self):
+        if has_request_context():
+            return g.get('_metrics')
+        return None
+
+    def _before_request(self):
+        g._metrics = {'start': time.perf_counter(), 'db_queries': 0, 'db_seconds': 0.0, 'render_seconds': 0.0}
+
+    def _after_request(self, response):
+        current = self._current()
+        if current is None:
+            return response
+        endpoint = request.endpoint or 'unknown'
+        if response.is_streamed:
+            # The body, and the queries it runs, come after this hook; count them
+            # once it has been sent. The header would be out before then.
+            response.call_on_close(lambda: self._record(endpoint, current))
+            return response
+        self._record(endpoint, current)
+        if self.query_count_header:
+            response.headers['X-Query-Count'] = str(current['db_queries'])
+        return response
+
+    def _record(self, endpoint, current):
+        elapsed = time.perf_counter() - current['start']
+        with self._lock:
+            totals = self.endpoints[endpoint]
+            totals['requests'] += 1
+            totals['db_queries'] += current['db_queries']
+            totals['db_seconds'] += current['db_seconds']
+            totals['render_seconds'] += current['render_seconds']
+            totals['request_seconds'] += elapsed
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_metrics_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['_metrics_start'].pop()
+        current = self._current()
+        if current is None:
+            return
+        current['db_queries'] += 1
+        current['db_seconds'] += elapsed
+        if elapsed >= self.slow_threshold:
+            self.slow_queries.append({'endpoint': request.endpoint, 'statement': statement,
+                                      'seconds': round(elapsed, 6), 'at': time.time()})
+
+    def _before_render(self, sender, template, context, **extra):
+        current = self._current()
+        if current is not None:
+            current['render_start'] = time.perf_counter()
+
+    def _after_render(self, sender, template, context, **extra):
+        current = self._current()
+        if current is not None and 'render_start' in current:
+            current['render_seconds'] += time.perf_counter() - current.pop('render_start')
+
+    def export(self):
+        lines = []
+        with self._lock:
+            endpoints = sorted((endpoint, dict(totals)) for endpoint, totals in self.endpoints.items())
+        for name, kind, help in FIELDS:
+            lines.append('# HELP fyyur_{}_total {}'.format(name, help))
+            lines.append('# TYPE fyyur_{}_total {}'.format(name, kind))
+            for endpoint, totals in endpoints:
+                lines.append('fyyur_{}_total{{endpoint="{}"}} {}'.format(name, endpoint, totals[name]))
+        for collect in self.collectors:
+            for name, kind, help, value in collect():
+                lines.append('# HELP fyyur_{} {}'.format(name, help))
+                lines.append('# TYPE fyyur_{} {}'.format(name, kind))
+                lines.append('fyyur_{} {}'.format(name, value))
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+    def export_slow(self):
+        return jsonify(list(self.slow_queries))
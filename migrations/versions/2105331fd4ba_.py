@@ -0,0 +1,28 @@
+"""add trigram indexes for venue and artist name search
+
+Revision ID: 2105331fd4ba
+Revises: 84a91cab2e6f
+Create Date: 2026-10-18 11:03:17.550912
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '2105331fd4ba'
+down_revision = '84a91cab2e6f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_Venue_name_trgm', 'Venue', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_Artist_name_trgm', 'Artist', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_Artist_name_trgm', table_name='Artist')
+    op.drop_index('ix_Venue_name_trgm', table_name='Venue')
@@ -0,0 +1,26 @@
+"""add row versions to venues and artists
+
+Revision ID: 7c41d2e9a0b3
+Revises: bf3e446dd78c
+Create Date: 2026-10-18 19:05:44.208153
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c41d2e9a0b3'
+down_revision = 'bf3e446dd78c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Venue', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('Artist', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    op.drop_column('Artist', 'version')
+    op.drop_column('Venue', 'version')
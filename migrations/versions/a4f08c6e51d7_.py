@@ -0,0 +1,24 @@
+"""keep finished jobs with their finish time
+
+Revision ID: a4f08c6e51d7
+Revises: 7c41d2e9a0b3
+Create Date: 2026-10-18 21:12:37.540219
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4f08c6e51d7'
+down_revision = '7c41d2e9a0b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Job', sa.Column('finished_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('Job', 'finished_at')
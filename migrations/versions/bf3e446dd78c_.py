@@ -0,0 +1,48 @@
+"""add genre indexes and the facet count table
+
+Revision ID: bf3e446dd78c
+Revises: eff0245bbc3d
+Create Date: 2026-10-18 18:32:07.415266
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'bf3e446dd78c'
+down_revision = 'eff0245bbc3d'
+branch_labels = None
+depends_on = None
+
+SEEKING = {'Venue': 'seeking_talent', 'Artist': 'seeking_venue'}
+
+
+def upgrade():
+    op.create_index('ix_Venue_genres', 'Venue', ['genres'], unique=False, postgresql_using='gin')
+    op.create_index('ix_Artist_genres', 'Artist', ['genres'], unique=False, postgresql_using='gin')
+    op.create_table('Facet',
+    sa.Column('model', sa.String(length=40), nullable=False),
+    sa.Column('facet', sa.String(length=40), nullable=False),
+    sa.Column('value', sa.String(length=120), nullable=False),
+    sa.Column('count', sa.Integer(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('model', 'facet', 'value')
+    )
+    # Same counts as Facets.rebuild: genres counted once per row, booleans as yes/no.
+    for model, seeking in SEEKING.items():
+        selects = [
+            'SELECT \'{0}\', \'state\', state, count(*) FROM "{0}" WHERE state <> \'\' GROUP BY state',
+            'SELECT \'{0}\', \'city\', city, count(*) FROM "{0}" WHERE city <> \'\' GROUP BY city',
+            'SELECT \'{0}\', \'genre\', genre, count(*) FROM (SELECT DISTINCT id, unnest(genres) AS genre '
+            'FROM "{0}") AS g WHERE genre <> \'\' GROUP BY genre',
+            'SELECT \'{0}\', \'seeking\', CASE WHEN {1} THEN \'yes\' ELSE \'no\' END, count(*) FROM "{0}" '
+            'WHERE {1} IS NOT NULL GROUP BY {1}',
+        ]
+        op.execute('INSERT INTO "Facet" (model, facet, value, count) '
+                   + ' UNION ALL '.join(selects).format(model, seeking))
+
+
+def downgrade():
+    op.drop_table('Facet')
+    op.drop_index('ix_Artist_genres', table_name='Artist')
+    op.drop_index('ix_Venue_genres', table_name='Venue')
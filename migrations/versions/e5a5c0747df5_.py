@@ -0,0 +1,40 @@
+"""add denormalised show counters to venues and artists
+
+Revision ID: e5a5c0747df5
+Revises: 328491b2ce56
+Create Date: 2026-10-18 15:02:09.431577
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a5c0747df5'
+down_revision = '328491b2ce56'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table, key in (('Venue', 'venue_id'), ('Artist', 'artist_id')):
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('next_show_time', sa.DateTime(), nullable=True))
+        op.create_index(op.f('ix_{}_next_show_time'.format(table)), table, ['next_show_time'], unique=False)
+        op.execute('''
+            UPDATE "{table}" SET
+                shows_count = (SELECT count(*) FROM "Show" WHERE "Show".{key} = "{table}".id),
+                upcoming_shows_count = (SELECT count(*) FROM "Show"
+                                        WHERE "Show".{key} = "{table}".id AND start_time >= now()),
+                next_show_time = (SELECT min(start_time) FROM "Show"
+                                  WHERE "Show".{key} = "{table}".id AND start_time >= now())
+        '''.format(table=table, key=key))
+
+
+def downgrade():
+    for table in ('Artist', 'Venue'):
+        op.drop_index(op.f('ix_{}_next_show_time'.format(table)), table_name=table)
+        op.drop_column(table, 'next_show_time')
+        op.drop_column(table, 'shows_count')
+        op.drop_column(table, 'upcoming_shows_count')
@@ -0,0 +1,25 @@
+"""extend the venue area index with id for keyset pagination
+
+Revision ID: e89495ad6599
+Revises: e5a5c0747df5
+Create Date: 2026-10-18 16:20:41.208315
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e89495ad6599'
+down_revision = 'e5a5c0747df5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_index('ix_Venue_city_state', table_name='Venue')
+    op.create_index('ix_Venue_city_state', 'Venue', ['city', 'state', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Venue_city_state', table_name='Venue')
+    op.create_index('ix_Venue_city_state', 'Venue', ['city', 'state'], unique=False)
@@ -0,0 +1,34 @@
+"""add show end times and reject overlapping bookings
+
+Revision ID: eff0245bbc3d
+Revises: d5a3067fa225
+Create Date: 2026-10-18 17:48:30.116902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'eff0245bbc3d'
+down_revision = 'd5a3067fa225'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Show', sa.Column('end_time', sa.DateTime(), nullable=True))
+    # SHOW_DURATION_MINUTES at the time of the migration
+    op.execute('UPDATE "Show" SET end_time = start_time + interval \'180 minutes\'')
+    op.alter_column('Show', 'end_time', nullable=False)
+    # Fails if existing shows already overlap; move or delete those first.
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    for key in ('venue', 'artist'):
+        op.execute('ALTER TABLE "Show" ADD CONSTRAINT "ex_Show_{0}_slot" '
+                   'EXCLUDE USING gist ({0}_id WITH =, tsrange(start_time, end_time) WITH &&)'.format(key))
+
+
+def downgrade():
+    for key in ('artist', 'venue'):
+        op.drop_constraint('ex_Show_{}_slot'.format(key), 'Show')
+    op.drop_column('Show', 'end_time')
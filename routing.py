@@ -0,0 +1,130 @@
+"""Send read-only requests to replica databases.
+
+``ReplicaRouter`` keeps one engine per URI in ``SQLALCHEMY_REPLICA_URIS``.
+``RoutingSession`` asks it for a bind before falling back to the primary:
+GET/HEAD requests, and views marked with ``read_only`` (the POST search
+forms), get a healthy replica chosen round-robin, held for the rest of the
+request. Everything else, including CLI commands, uses the primary.
+
+Replicas are health-checked at most every ``REPLICA_CHECK_INTERVAL``
+seconds; on PostgreSQL one lagging more than ``REPLICA_MAX_LAG`` seconds
+counts as unhealthy. After a write request the client gets a cookie that
+pins its reads to the primary for ``REPLICA_STICKY_SECONDS``, so the page
+it is redirected to shows its own write.
+"""
+import itertools
+import threading
+import time
+
+import sqlalchemy as sa
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+
+STICKY_COOKIE = 'fyyur_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def read_only(view):
+    # Mark a non-GET view (e.g. a POST search form) as safe to serve from a replica.
+    view.read_only = True
+    return view
+
+
+class RoutingSession(Session):
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context():
+            router = current_app.extensions.get('replicas')
+            replica = router.bind_for_request() if router is not None else None
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class Replica(object):
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.healthy = True
+        self.checked = 0.0
+
+
+class ReplicaRouter(object):
+
+    def __init__(self, app=None):
+        self.replicas = []
+        self._cycle = itertools.count()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('REPLICA_CHECK_INTERVAL', 5)
+        app.config.setdefault('REPLICA_MAX_LAG', 10)
+        app.config.setdefault('REPLICA_STICKY_SECONDS', 5)
+        self.check_interval = app.config['REPLICA_CHECK_INTERVAL']
+        self.max_lag = app.config['REPLICA_MAX_LAG']
+        self.sticky_seconds = app.config['REPLICA_STICKY_SECONDS']
+        options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        self.replicas = [Replica(sa.create_engine(uri, **options)) for uri in app.config['SQLALCHEMY_REPLICA_URIS']]
+        app.after_request(self._pin_after_write)
+        app.extensions['replicas'] = self
+
+    def _is_read_only_view(self):
+        # By the view function, whatever endpoint name a blueprint gives it.
+        view = current_app.view_functions.get(request.endpoint)
+        return getattr(view, 'read_only', False)
+
+    def _is_read_request(self):
+        if request.cookies.get(STICKY_COOKIE):
+            return False
+        return request.method in SAFE_METHODS or self._is_read_only_view()
+
+    def bind_for_request(self):
+        if not self.replicas:
+            return None
+        if '_replica' not in g:
+            g._replica = self.choose() if self._is_read_request() else None
+        return g._replica
+
+    def choose(self):
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self._cycle) % len(self.replicas)]
+            if self._check(replica):
+                return replica.engine
+        return None
+
+    def _check(self, replica):
+        now = time.monotonic()
+        if now - replica.checked < self.check_interval:
+            return replica.healthy
+        with self._lock:
+            if now - replica.checked < self.check_interval:
+                return replica.healthy
+            replica.checked = now
+            try:
+                with replica.engine.connect() as connection:
+                    lag = 0
+                    if replica.engine.dialect.name == 'postgresql':
+                        lag = connection.execute(sa.text(
+                            'SELECT COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)'
+                        )).scalar()
+                    else:
+                        connection.execute(sa.text('SELECT 1'))
+                replica.healthy = lag <= self.max_lag
+            except sa.exc.SQLAlchemyError:
+                replica.healthy = False
+            if not replica.healthy:
+                current_app.logger.warning('Replica %s is unhealthy', replica.engine.url)
+        return replica.healthy
+
+    def _pin_after_write(self, response):
+        if self.replicas and request.method not in SAFE_METHODS \
+                and not self._is_read_only_view() and response.status_code < 400:
+            response.set_cookie(STICKY_COOKIE, '1', max_age=self.sticky_seconds, httponly=True, samesite='Lax')
+        return response
+
+    def dispose(self):
+        for replica in self.replicas:
+            replica.engine.dispose(close=False)
@@ -0,0 +1,124 @@
+"""Name search backends for /venues/search and /artists/search.
+
+``TrigramSearch`` runs a case-insensitive ILIKE that PostgreSQL answers from
+the pg_trgm GIN indexes on ``name`` and ranks matches by trigram similarity.
+``MemorySearch`` is the fallback for databases without pg_trgm (SQLite test
+runs): it keeps a per-process trigram index of names, rebuilt lazily after
+``invalidate()``.
+
+Both page through results in rank order: ``after`` is the id of the last
+match on the previous page, and a cursor that no longer matches ends the
+listing. ``count`` stops at ``cap`` matches so large result sets stay cheap.
+``criteria`` (the facet filters) narrow the matches further.
+"""
+from collections import defaultdict
+
+from sqlalchemy import func, tuple_
+
+
+def _escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramSearch(object):
+
+    def _matches(self, model, term, criteria):
+        return model.query.filter(model.name.ilike('%{}%'.format(_escape_like(term)), escape='\\'), *criteria)
+
+    def search(self, model, term, limit, after=None, criteria=()):
+        query = self._matches(model, term, criteria).with_entities(model.id, model.name)
+        rank = model.name.op('<->')(term) if term else None
+        if after is not None:
+            if rank is None:
+                query = query.filter(model.id > after)
+            else:
+                cursor = model.query.with_entities(rank).filter(model.id==after).scalar_subquery()
+                query = query.filter(tuple_(rank, model.id) > tuple_(cursor, after))
+        if rank is not None:
+            query = query.order_by(rank)
+        return query.order_by(model.id).limit(limit).all()
+
+    def count(self, model, term, cap, criteria=()):
+        matches = self._matches(model, term, criteria).with_entities(model.id).limit(cap).subquery()
+        return model.query.session.query(func.count()).select_from(matches).scalar()
+
+    def invalidate(self, model):
+        pass
+
+
+class MemorySearch(object):
+
+    def __init__(self):
+        self._indexes = {}
+
+    def _index(self, model):
+        if model not in self._indexes:
+            names, grams = {}, defaultdict(set)
+            for id, name in model.query.with_entities(model.id, model.name).order_by(model.id):
+                names[id] = (name, name.lower())
+                for gram in _trigrams(names[id][1]):
+                    grams[gram].add(id)
+            self._indexes[model] = (names, grams)
+        return self._indexes[model]
+
+    def _ranked(self, model, term, criteria):
+        names, grams = self._index(model)
+        term = term.lower()
+        candidates = names
+        if len(term) >= 3:
+            candidates = set.intersection(*(grams.get(gram, set()) for gram in _trigrams(term)))
+        if criteria:
+            candidates = set(candidates) & {id for id, in model.query.with_entities(model.id).filter(*criteria)}
+        return names, {id: (names[id][1].find(term), len(names[id][1]), id)
+                       for id in candidates if term in names[id][1]}
+
+    def search(self, model, term, limit, after=None, criteria=()):
+        names, ranks = self._ranked(model, term, criteria)
+        matches = sorted(ranks.values())
+        if after is not None:
+            if after not in ranks:
+                return []
+            matches = [rank for rank in matches if rank > ranks[after]]
+        return [(id, names[id][0]) for _, _, id in matches[:limit]]
+
+    def count(self, model, term, cap, criteria=()):
+        return min(len(self._ranked(model, term, criteria)[1]), cap)
+
+    def invalidate(self, model):
+        self._indexes.pop(model, None)
+
+
+class Search(object):
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SEARCH_BACKEND', 'auto')
+        app.config.setdefault('SEARCH_RESULT_LIMIT', 50)
+        app.config.setdefault('SEARCH_COUNT_LIMIT', 1000)
+        backend = app.config['SEARCH_BACKEND']
+        if backend == 'auto':
+            uri = app.config.get('SQLALCHEMY_DATABASE_URI') or ''
+            backend = 'trigram' if uri.startswith('postgres') else 'memory'
+        self.backend = {'trigram': TrigramSearch, 'memory': MemorySearch}[backend]()
+        self.limit = app.config['SEARCH_RESULT_LIMIT']
+        self.count_limit = app.config['SEARCH_COUNT_LIMIT']
+        app.extensions['search'] = self
+
+    def __call__(self, model, term, after=None, limit=None, criteria=()):
+        return self.backend.search(model, term, limit or self.limit, after, criteria)
+
+    def count(self, model, term, criteria=()):
+        # Returns (count, exact); counting stops at SEARCH_COUNT_LIMIT.
+        count = self.backend.count(model, term, self.count_limit, criteria)
+        return count, count < self.count_limit
+
+    def invalidate(self, model):
+        self.backend.invalidate(model)
@@ -0,0 +1,67 @@
+"""Listings rendered while their rows are still coming off the database.
+
+A ``Page`` wraps a keyset-paginated query. ``page.all()`` fetches it in one
+go like before; iterating the page instead runs the query with
+``yield_per(STREAM_BATCH_SIZE)`` (a server-side cursor on PostgreSQL) and
+hands the rows to the template one batch at a time. Either way ``page.next``
+holds the cursor of the following page once the rows are exhausted, so
+templates read it after their loop.
+
+With ``STREAM_LISTINGS`` the listing views return ``stream_page(...)``:
+``stream_template`` output, joined into chunks of ``STREAM_BUFFER_SIZE``
+bytes. The head of the page goes out before the first row is fetched, and
+memory stays at one batch of rows instead of the whole page, which is what
+lets ``?limit=`` go up to ``STREAM_MAX_PAGE_SIZE``. The status line is sent
+first, so a database error half way through truncates the page instead of
+turning it into a 500.
+"""
+from flask import Response, current_app, stream_template
+
+
+class Page(object):
+
+    def __init__(self, query, limit, row=None, cursor=None):
+        # row turns a result row into what the template gets, cursor turns
+        # the last row of the page into the value of page.next.
+        self.query = query
+        self.limit = limit
+        self.row = row or (lambda row: row)
+        self.cursor = cursor or (lambda row: row.id)
+        self.next = None
+
+    def all(self):
+        rows = self.query.limit(self.limit + 1).all()
+        if len(rows) > self.limit:
+            self.next = self.cursor(rows[self.limit - 1])
+        return [self.row(row) for row in rows[:self.limit]]
+
+    def __iter__(self):
+        last = None
+        rows = self.query.limit(self.limit + 1).yield_per(current_app.config['STREAM_BATCH_SIZE'])
+        for i, row in enumerate(rows):
+            if i == self.limit:
+                self.next = self.cursor(last)
+                break
+            last = row
+            yield self.row(row)
+
+
+def buffered(chunks, size):
+    # Jinja yields a chunk per template statement; joining them saves the
+    # server a write per tag.
+    buffer, length = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def stream_page(template_name, **context):
+    # stream_template keeps the request context (and with it the session) alive
+    # until the last chunk is out.
+    chunks = stream_template(template_name, **context)
+    return Response(buffered(chunks, current_app.config['STREAM_BUFFER_SIZE']), mimetype='text/html')
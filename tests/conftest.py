@@ -0,0 +1,127 @@
+"""Fixtures shared by the test suite.
+
+    $ python -m pytest
+    $ TEST_DATABASE_URL=postgresql://postgres@localhost:5432/fyyur_test python -m pytest
+
+Without TEST_DATABASE_URL the tests run on a throwaway SQLite file, which
+exercises the in-process search and booking backends; with it they run on
+PostgreSQL and its trigram search, range constraints and array facets. Every
+table of that database is dropped and recreated, so never point it at real
+data.
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DATABASE_URL = os.environ.get('TEST_DATABASE_URL') or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'fyyur.db')
+# read by config.py when app.py imports it
+os.environ['DATABASE_URL'] = DATABASE_URL
+
+import app as fyyur  # noqa: E402
+
+SETTINGS = {
+    'TESTING': True,
+    'WTF_CSRF_ENABLED': False,
+    'METRICS_QUERY_COUNT_HEADER': True,
+    'CACHE_TYPE': 'null',
+    'FRAGMENT_CACHE_TYPE': 'null',
+    'JOBS_IN_PROCESS': False,
+}
+
+VENUE_FORM = {'city': 'San Francisco', 'state': 'CA', 'address': '1015 Folsom Street',
+              'phone': '123-123-1234', 'genres': ['Jazz']}
+ARTIST_FORM = {'city': 'San Francisco', 'state': 'CA', 'phone': '326-123-5000', 'genres': ['Rock n Roll']}
+
+
+def query_count(response):
+    return int(response.headers['X-Query-Count'])
+
+
+@pytest.fixture(scope='session')
+def database():
+    app = fyyur.create_app(**SETTINGS)
+    with app.app_context():
+        fyyur.db.drop_all()
+        fyyur.db.create_all()
+    yield
+    with app.app_context():
+        fyyur.db.drop_all()
+        fyyur.db.engine.dispose()
+
+
+@pytest.fixture
+def make_app(database):
+    """create_app(**settings) on top of SETTINGS; the tables are emptied afterwards."""
+    apps = []
+
+    def make(**settings):
+        app = fyyur.create_app(**dict(SETTINGS, **settings))
+        apps.append(app)
+        return app
+
+    yield make
+    for app in apps:
+        with app.app_context():
+            fyyur.aio.dispose()
+            fyyur.db.session.remove()
+            for engine in fyyur.db.engines.values():
+                engine.dispose()
+    app = fyyur.create_app(**SETTINGS)
+    with app.app_context():
+        for table in reversed(fyyur.db.metadata.sorted_tables):
+            fyyur.db.session.execute(table.delete())
+        fyyur.db.session.commit()
+        fyyur.db.engine.dispose()
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def seed(app):
+    """seed(venues, artists, shows) adds rows and returns their ids.
+
+    Every call adds new venues and artists; their shows are a day apart, half
+    of them in the past, so none overlap.
+    """
+    def seed(venues=2, artists=2, shows=4):
+        Venue, Artist, Show = fyyur.Venue, fyyur.Artist, fyyur.Show
+        now = datetime.now().replace(microsecond=0)
+        with app.app_context():
+            venue_rows = [Venue(name='Venue {}'.format(i), city='City {}'.format(i % 3), state='CA',
+                                address='{} Main St'.format(i), phone='415-000-0000',
+                                genres=['Jazz', 'Blues'] if i % 2 else ['Rock n Roll'], seeking_talent=bool(i % 2))
+                          for i in range(venues)]
+            artist_rows = [Artist(name='Artist {}'.format(i), city='City {}'.format(i % 3), state='NY',
+                                  phone='326-000-0000', genres=['Jazz'], seeking_venue=bool(i % 2))
+                           for i in range(artists)]
+            fyyur.db.session.add_all(venue_rows + artist_rows)
+            fyyur.db.session.flush()
+            for i in range(shows):
+                start_time = now + timedelta(days=i - shows // 2, hours=1)
+                fyyur.db.session.add(Show(venue_id=venue_rows[i % venues].id, artist_id=artist_rows[i % artists].id,
+                                          start_time=start_time, end_time=fyyur.show_end_time(start_time)))
+            fyyur.db.session.flush()
+            fyyur.refresh_show_counters(Venue, Show.venue_id)
+            fyyur.refresh_show_counters(Artist, Show.artist_id)
+            for model in (Venue, Artist):
+                fyyur.facets.rebuild(model)
+            fyyur.db.session.commit()
+            fyyur.bookings.invalidate()
+            for model in (Venue, Artist):
+                fyyur.search.invalidate(model)
+            return [venue.id for venue in venue_rows], [artist.id for artist in artist_rows]
+
+    return seed
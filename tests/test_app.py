@@ -0,0 +1,154 @@
+"""The app factory, startup checks, metrics and the API's conditional GETs."""
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as fyyur
+from conftest import DATABASE_URL, query_count
+
+ASYNC_DRIVERS = {'sqlite': ('sqlite+aiosqlite', 'aiosqlite'), 'postgresql': ('postgresql+asyncpg', 'asyncpg')}
+
+
+def test_every_app_serves_the_site(make_app, seed):
+    venues, _ = seed()
+    first, second = make_app().test_client(), make_app().test_client()
+    for path in ('/', '/venues', '/venues/{}'.format(venues[0]), '/shows/calendar'):
+        assert first.get(path).status_code == 200, path
+        assert second.get(path).status_code == 200, path
+    # a second app must not attach its listeners again
+    assert query_count(second.get('/venues')) == query_count(first.get('/venues'))
+    assert second.get('/nowhere').status_code == 404
+
+
+def test_cli_commands_are_top_level(app):
+    assert {'import', 'export', 'rebuild-facets', 'check-db', 'run-jobs'} <= set(app.cli.commands)
+
+
+def test_connection_budget_counts_every_pool(make_app):
+    app = make_app(SQLALCHEMY_ENGINE_OPTIONS={'pool_size': 5, 'max_overflow': 5},
+                   SQLALCHEMY_REPLICA_URIS=[DATABASE_URL], ASYNC_DATABASE_URI='sqlite+aiosqlite://',
+                   ASYNC_POOL_SIZE=8, ASYNC_MAX_OVERFLOW=2, JOBS_WORKERS=3)
+    # primary and one replica at 5 + 5, async at 8 + 2, and the job worker's threads
+    assert fyyur.connection_budget(app, 4) == (30, 4 * 30 + 3)
+
+
+def test_check_database_refuses_per_process_caches(make_app):
+    assert fyyur.check_database(make_app(CACHE_TYPE='simple', FRAGMENT_CACHE_TYPE='null'), 1) == []
+    problems = fyyur.check_database(make_app(CACHE_TYPE='simple', FRAGMENT_CACHE_TYPE='null'), 2)
+    assert len(problems) == 1 and 'CACHE_TYPE' in problems[0]
+    assert fyyur.check_database(make_app(CACHE_TYPE='null', FRAGMENT_CACHE_TYPE='null'), 2) == []
+
+
+def test_streamed_queries_are_counted(make_app, seed):
+    seed(venues=2, artists=2, shows=10)
+    client = make_app(STREAM_LISTINGS=True).test_client()
+    totals = client.application.extensions['metrics'].endpoints['main.shows']
+    before = totals['db_queries']
+    response = client.get('/shows')
+    assert 'X-Query-Count' not in response.headers
+    response.get_data()
+    response.close()
+    assert totals['db_queries'] > before
+
+
+def test_async_queries_are_counted(make_app, seed):
+    dialect = DATABASE_URL.split(':')[0].split('+')[0]
+    scheme, driver = ASYNC_DRIVERS[dialect]
+    pytest.importorskip(driver)
+    venues, _ = seed()
+    path = '/venues/{}'.format(venues[0])
+    expected = query_count(make_app().test_client().get(path))
+    client = make_app(ASYNC_DATABASE_URI=scheme + DATABASE_URL[len(DATABASE_URL.split(':')[0]):]).test_client()
+    response = client.get(path)
+    assert response.status_code == 200
+    assert query_count(response) == expected
+
+
+def test_api_detail_is_not_served_from_the_page_cache(make_app, seed):
+    venues, _ = seed()
+    app = make_app(CACHE_TYPE='simple')
+    client = app.test_client()
+    assert b'Venue 0' in client.get('/venues/{}'.format(venues[0])).data
+    # a write the cache does not hear about, e.g. from another worker
+    with app.app_context():
+        fyyur.Venue.query.filter_by(id=venues[0]).update({'name': 'Renamed'})
+        fyyur.db.session.commit()
+    response = client.get('/api/v1/venues/{}'.format(venues[0]))
+    assert response.get_json()['name'] == 'Renamed'
+    again = client.get('/api/v1/venues/{}'.format(venues[0]), headers={'If-None-Match': response.headers['ETag']})
+    assert again.status_code == 304
+
+
+
+def test_weak_etags_are_revalidated(client, seed):
+    seed()
+    etag = client.get('/api/v1/artists').headers['ETag'].strip('"')
+    response = client.get('/api/v1/artists', headers={'If-None-Match': 'W/"{}"'.format(etag)})
+    assert response.status_code == 304
+
+
+def test_listing_etags_follow_the_rows_on_the_page(app, client, seed):
+    venues, artists = seed(venues=3, artists=3, shows=0)
+    etag = client.get('/api/v1/artists?limit=1').headers['ETag']
+    with app.app_context():
+        # past the first row of the next page: not part of this page's version
+        fyyur.Artist.query.filter_by(id=artists[2]).update({'name': 'Renamed'})
+        fyyur.db.session.commit()
+    response = client.get('/api/v1/artists?limit=1', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert query_count(response) == 1
+    with app.app_context():
+        fyyur.Artist.query.filter_by(id=artists[0]).update({'name': 'Renamed'})
+        fyyur.db.session.commit()
+    assert client.get('/api/v1/artists?limit=1', headers={'If-None-Match': etag}).status_code == 200
+    # a new show changes the venue's upcoming count in the listing
+    etag = client.get('/api/v1/venues').headers['ETag']
+    start_time = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+    client.post('/shows/create', data={'venue_id': venues[0], 'artist_id': artists[0], 'start_time': start_time})
+    assert client.get('/api/v1/venues', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_apps_keep_their_own_settings(make_app, seed):
+    seed()
+    first = make_app(CACHE_TYPE='simple', METRICS_QUERY_COUNT_HEADER=False)
+    second = make_app()
+    # building the second app left the first one's store and header alone
+    assert first.extensions['cache'].store is not second.extensions['cache'].store
+    assert 'X-Query-Count' not in first.test_client().get('/venues').headers
+    assert 'X-Query-Count' in second.test_client().get('/venues').headers
+
+
+def test_check_assets_needs_the_manifest_when_bundled(make_app):
+    assert fyyur.check_assets(make_app(ASSETS_BUNDLED=False)) == []
+    app = make_app(ASSETS_BUNDLED=True)
+    app.extensions['assets'].manifest = {}
+    assert len(fyyur.check_assets(app)) == 1
+    app.extensions['assets'].manifest = {'main.css': 'main.0123456789ab.css'}
+    assert fyyur.check_assets(app) == []
+
+
+def test_job_metrics_come_from_the_table(make_app):
+    # the worker runs in another process; the web app's /_metrics still sees its jobs
+    worker, web = make_app(), make_app()
+    with worker.app_context():
+        worker.extensions['jobs'].enqueue('check_links', kind='venue', id=0)
+        fyyur.db.session.commit()
+    metrics = web.test_client().get('/_metrics').data.decode().splitlines()
+    assert {'fyyur_jobs_queued 1', 'fyyur_jobs_finished 0'} <= set(metrics)
+    with worker.app_context():
+        assert worker.extensions['jobs'].run_once()
+    metrics = web.test_client().get('/_metrics').data.decode().splitlines()
+    assert {'fyyur_jobs_queued 0', 'fyyur_jobs_finished 1', 'fyyur_jobs_oldest_queued_seconds 0'} <= set(metrics)
+
+
+def test_thumbnail_urls_survive_a_restart(make_app):
+    # a restarted process, or another dyno, has a SECRET_KEY of its own
+    first = make_app(THUMBNAIL_SIGNING_KEY='k', SECRET_KEY='one')
+    second = make_app(THUMBNAIL_SIGNING_KEY='k', SECRET_KEY='two')
+    with first.test_request_context():
+        url = first.extensions['thumbnails'].url('https://example.com/a.png', 'tile')
+    token = url.rsplit('/', 1)[1].rsplit('.', 1)[0]
+    assert second.extensions['thumbnails'].serializer.loads(token) == 'https://example.com/a.png'
+    assert fyyur.check_thumbnails(first) == []
+    problems = fyyur.check_thumbnails(make_app(THUMBNAIL_SIGNING_KEY=None))
+    assert len(problems) == (1 if first.extensions['thumbnails'].enabled else 0)
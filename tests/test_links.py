@@ -0,0 +1,122 @@
+"""Remote fetches (thumbnails, link checks) stay on public hosts."""
+import http.server
+import io
+import threading
+import urllib.request
+
+import pytest
+
+import app as fyyur
+import thumbnails
+
+
+class RedirectHandler(http.server.BaseHTTPRequestHandler):
+    # /start redirects to /private on the server's target, itself by default
+
+    def do_GET(self):
+        if self.path == '/start':
+            self.send_response(302)
+            self.send_header('Location', 'http://127.0.0.1:{}/private'.format(self.server.target))
+        else:
+            self.server.reached.append(self.path)
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+        self.end_headers()
+
+    do_HEAD = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(target=None):
+    server = http.server.HTTPServer(('127.0.0.1', 0), RedirectHandler)
+    server.target = target or server.server_port
+    server.reached = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def server():
+    server = serve()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def public(server, monkeypatch):
+    # A second loopback server that the checks take for a public host; its
+    # /start redirects to server, which is checked for real.
+    public = serve(server.server_port)
+    public_address = thumbnails.public_address
+    monkeypatch.setattr(thumbnails, 'public_address',
+                        lambda host, port: '127.0.0.1' if port == public.server_port else public_address(host, port))
+    yield public
+    public.shutdown()
+    public.server_close()
+
+
+def test_private_urls_are_refused(server):
+    with pytest.raises(OSError):
+        thumbnails.open_public(urllib.request.Request('http://127.0.0.1:{}/private'.format(server.server_port)), 1)
+    with pytest.raises(OSError):
+        thumbnails.open_public(urllib.request.Request('file:///etc/passwd'), 1)
+    assert server.reached == []
+
+
+def test_redirects_to_private_hosts_are_refused(server, public):
+    with pytest.raises(OSError):
+        thumbnails.open_public(urllib.request.Request('http://127.0.0.1:{}/start'.format(public.server_port)), 1)
+    assert server.reached == []
+
+
+def test_connections_go_to_the_checked_address(public):
+    # the socket goes to the address the check returned; the name itself does not resolve
+    url = 'http://images.example.invalid:{}/picture'.format(public.server_port)
+    with thumbnails.open_public(urllib.request.Request(url), 1) as response:
+        assert response.status == 200
+    assert public.reached == ['/picture']
+
+
+def test_link_check_stays_off_private_hosts(app, server, public):
+    with app.app_context():
+        assert not fyyur.link_ok('http://127.0.0.1:{}/private'.format(server.server_port))
+        assert not fyyur.link_ok('http://127.0.0.1:{}/start'.format(public.server_port), image=True)
+    assert server.reached == []
+
+
+@pytest.mark.parametrize('url', ['ftp://example.com/a.png', 'http://localhost/a.png', 'http://10.0.0.1/a.png',
+                                 'http://169.254.169.254/latest/meta-data', 'not a url'])
+def test_is_public_url(url):
+    assert not thumbnails.is_public_url(url)
+
+
+def test_thumbnails_are_rendered_in_the_background(make_app, tmp_path, monkeypatch):
+    Image = pytest.importorskip('PIL.Image')
+    app = make_app(THUMBNAIL_CACHE_DIR=str(tmp_path))
+    thumbs, jobs = app.extensions['thumbnails'], app.extensions['jobs']
+    source = io.BytesIO()
+    Image.new('RGB', (800, 800)).save(source, 'PNG')
+    monkeypatch.setattr(thumbs, 'fetch', lambda image_link: source.getvalue())
+    image_link = 'https://images.example.com/a.png'
+    with app.test_request_context():
+        url = thumbs.url(image_link, 'tile', 'webp')
+    client = app.test_client()
+    # a miss sends the browser to the original and queues the render, once
+    for _ in range(2):
+        response = client.get(url)
+        assert (response.status_code, response.location) == (302, image_link)
+    with app.app_context():
+        assert fyyur.db.session.query(jobs.table).filter_by(name='render_thumbnail').count() == 1
+        assert jobs.run_once()
+    response = client.get(url)
+    assert (response.status_code, response.mimetype) == (200, 'image/webp')
+
+
+def test_recent_thumbnail_links_are_bounded(make_app):
+    thumbs = make_app(THUMBNAIL_RECENT_LINKS=2).extensions['thumbnails']
+    assert all(thumbs.attempt('https://images.example.com/{}.png'.format(i)) for i in range(3))
+    assert not thumbs.attempt('https://images.example.com/2.png')
+    assert list(thumbs._recent) == ['https://images.example.com/1.png', 'https://images.example.com/2.png']
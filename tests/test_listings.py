@@ -0,0 +1,133 @@
+"""Query counts of the read routes: a fixed number of statements per page,
+however many venues, artists and shows there are."""
+import re
+
+import pytest
+
+import app as fyyur
+from conftest import query_count
+
+# Upper bounds for both backends; PostgreSQL adds the pg_class estimate to the
+# listing totals.
+ROUTES = {
+    '/venues': 4,
+    '/artists': 4,
+    '/shows': 1,
+    '/venues/{venue}': 3,
+    '/artists/{artist}': 3,
+    '/venues/{venue}/calendar': 2,
+    '/shows/calendar': 1,
+    '/api/v1/venues': 2,
+    '/api/v1/artists': 2,
+    '/api/v1/shows': 2,
+    '/api/v1/venues/{venue}': 4,
+    '/api/v1/artists/{artist}': 4,
+}
+
+
+def get_counts(client, venue, artist):
+    counts = {}
+    for route in ROUTES:
+        response = client.get(route.format(venue=venue, artist=artist))
+        assert response.status_code == 200, route
+        counts[route] = query_count(response)
+    return counts
+
+
+def test_query_counts_do_not_grow_with_the_data(client, seed):
+    venues, artists = seed(venues=2, artists=2, shows=4)
+    small = get_counts(client, venues[0], artists[0])
+    seed(venues=30, artists=30, shows=120)
+    large = get_counts(client, venues[0], artists[0])
+    assert large == small
+    for route, bound in ROUTES.items():
+        assert small[route] <= bound, route
+
+
+@pytest.mark.parametrize('path', ['/venues/search', '/artists/search'])
+def test_search_query_count(client, seed, path):
+    seed(venues=2, artists=2)
+    small = query_count(client.post(path, data={'search_term': 'e'}))
+    seed(venues=30, artists=30)
+    response = client.post(path, data={'search_term': 'e'})
+    assert response.status_code == 200
+    assert query_count(response) == small
+
+
+def test_venues_grouped_by_area(client, seed):
+    venues, _ = seed(venues=6, artists=2, shows=12)
+    page = client.get('/venues').get_data(as_text=True)
+    for i in range(6):
+        assert 'Venue {}'.format(i) in page
+    assert page.count('<h3>City 0, CA</h3>') == 1
+
+
+def test_listings_page_with_after_and_limit(client, seed):
+    venues, artists = seed(venues=5, artists=5, shows=10)
+    first = client.get('/api/v1/artists?limit=2').get_json()
+    assert [artist['id'] for artist in first['artists']] == artists[:2]
+    second = client.get('/api/v1/artists?limit=2&after={}'.format(first['next'])).get_json()
+    assert [artist['id'] for artist in second['artists']] == artists[2:4]
+    assert client.get('/venues?after=abc').status_code == 400
+
+
+def without_csrf_token(page):
+    return re.sub(r'name="csrf_token" value="[^"]*"', '', page)
+
+
+def test_streamed_listings_match_buffered(make_app, seed):
+    seed(venues=4, artists=4, shows=20)
+    buffered = make_app().test_client()
+    pages = {path: without_csrf_token(buffered.get(path).get_data(as_text=True))
+             for path in ('/shows', '/artists', '/venues')}
+    streamed = make_app(STREAM_LISTINGS=True).test_client()
+    for path, page in pages.items():
+        response = streamed.get(path)
+        assert response.is_streamed
+        assert without_csrf_token(response.get_data(as_text=True)) == page, path
+
+
+@pytest.mark.parametrize('query, venues', [
+    ('genre=Jazz', [1, 3]),
+    ('genre=Rock n Roll', [0, 2]),
+    ('seeking=yes', [1, 3]),
+    ('genre=Jazz&city=City 1', [1]),
+])
+def test_facets_filter_the_listing(client, seed, query, venues):
+    ids, _ = seed(venues=4, artists=1, shows=0)
+    page = client.get('/venues?' + query).get_data(as_text=True)
+    listed = [i for i, id in enumerate(ids) if '/venues/{}"'.format(id) in page]
+    assert listed == venues
+
+
+def test_facets_reject_unknown_boolean_values(client, seed):
+    seed(venues=2, artists=2, shows=0)
+    assert client.get('/venues?seeking=garbage').status_code == 400
+    assert client.post('/artists/search', data={'search_term': 'a', 'seeking': 'maybe'}).status_code == 400
+
+
+def test_calendar_month_out_of_range(client):
+    assert client.get('/shows/calendar?month=2030-05').status_code == 200
+    for month in ('9999-12', '0001-01', '2030-13', 'soon'):
+        assert client.get('/shows/calendar?month=' + month).status_code == 400, month
+
+
+def test_show_tiles_cost_one_store_read_each(make_app, seed):
+    app = make_app(FRAGMENT_CACHE_TYPE='simple')
+    client = app.test_client()
+    _, artists = seed(venues=2, artists=2, shows=4)
+    store = app.extensions['fragments'].store
+    reads = []
+    get, get_many = store.get, store.get_many
+    store.get = lambda key: reads.append(key) or get(key)
+    store.get_many = lambda keys: reads.append(keys) or get_many(keys)
+    client.get('/shows')
+    del reads[:]
+    assert client.get('/shows').data.count(b'tile-show') == 4
+    assert len(reads) == 4
+    # an edit bumps the artist's version, which the tile key carries
+    with app.app_context():
+        artist = fyyur.db.session.get(fyyur.Artist, artists[0])
+        artist.name = 'Renamed Artist'
+        fyyur.db.session.commit()
+    assert b'Renamed Artist' in client.get('/shows').data
@@ -0,0 +1,179 @@
+"""Create, edit and import: counters, facets, bookings and optimistic locking."""
+import io
+from datetime import datetime, timedelta, timezone
+
+import app as fyyur
+from conftest import ARTIST_FORM, VENUE_FORM
+
+
+def show_form(venue_id, artist_id, start_time):
+    return {'venue_id': str(venue_id), 'artist_id': str(artist_id),
+            'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def test_create_show_updates_counters(app, client, seed):
+    venues, artists = seed(venues=1, artists=1, shows=0)
+    start_time = (datetime.now() + timedelta(days=3)).replace(microsecond=0)
+    response = client.post('/shows/create', data=show_form(venues[0], artists[0], start_time))
+    assert response.status_code == 302
+    with app.app_context():
+        show = fyyur.Show.query.one()
+        assert (show.venue_id, show.artist_id, show.start_time) == (venues[0], artists[0], start_time)
+        venue = fyyur.db.session.get(fyyur.Venue, venues[0])
+        assert (venue.shows_count, venue.upcoming_shows_count, venue.next_show_time) == (1, 1, start_time)
+        assert fyyur.db.session.get(fyyur.Artist, artists[0]).upcoming_shows_count == 1
+
+
+def test_create_show_rejects_bad_ids(app, client, seed):
+    venues, artists = seed(venues=1, artists=1, shows=0)
+    start_time = datetime.now() + timedelta(days=3)
+    response = client.post('/shows/create', data=show_form('{}x'.format(venues[0]), artists[0], start_time))
+    assert response.status_code == 200
+    assert b'Invalid value found in venue_id' in response.data
+    with app.app_context():
+        assert fyyur.Show.query.count() == 0
+
+
+def test_double_booking_is_rejected(app, client, seed):
+    venues, artists = seed(venues=1, artists=2, shows=0)
+    start_time = datetime.now().replace(microsecond=0) + timedelta(days=3)
+    assert client.post('/shows/create', data=show_form(venues[0], artists[0], start_time)).status_code == 302
+    overlapping = client.post('/shows/create', data=show_form(venues[0], artists[1], start_time + timedelta(hours=1)))
+    assert overlapping.status_code == 409
+    later = start_time + timedelta(minutes=app.config['SHOW_DURATION_MINUTES'])
+    assert client.post('/shows/create', data=show_form(venues[0], artists[1], later)).status_code == 302
+    window = client.get('/api/v1/venues/{}/availability?from={}&to={}'.format(
+        venues[0], start_time.date().isoformat(), (start_time + timedelta(days=1)).date().isoformat())).get_json()
+    assert len(window['booked']) == 2
+
+
+def test_availability_accepts_offsets(client, seed):
+    venues, _ = seed(venues=1, artists=1, shows=0)
+    response = client.get('/api/v1/venues/{}/availability?from=2030-01-01T10:00:00%2B02:00'.format(venues[0]))
+    assert response.status_code == 200
+    # stored times are naive local time, so the offset is converted to that
+    local = datetime(2030, 1, 1, 8, tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+    assert response.get_json()['from'] == local.isoformat()
+    response = client.get('/api/v1/venues/{}/availability?from=2030-01-01T10:00:00Z&to=2030-01-02'.format(venues[0]))
+    assert response.status_code == 200
+    assert client.get('/venues/{}/shows.ics?from=2030-01-01T00:00:00Z'.format(venues[0])).status_code == 200
+
+
+def test_created_venue_is_counted_in_its_facets(app, client):
+    response = client.post('/venues/create', data=dict(VENUE_FORM, name='The Musical Hop', seeking_talent='y'))
+    assert response.status_code == 302
+    with app.app_context():
+        assert fyyur.facets.count(fyyur.Venue, 'genre', 'Jazz') == 1
+        assert fyyur.facets.count(fyyur.Venue, 'seeking', 'yes') == 1
+    assert b'The Musical Hop' in client.get('/venues?genre=Jazz').data
+    assert b'The Musical Hop' not in client.get('/venues?genre=Blues').data
+
+
+def edit_form(app, venue_id, **changes):
+    with app.app_context():
+        venue = fyyur.db.session.get(fyyur.Venue, venue_id)
+        form = {'name': venue.name, 'city': venue.city, 'state': venue.state, 'address': venue.address,
+                'phone': venue.phone, 'genres': venue.genres, 'version': str(venue.version)}
+    form.update(changes)
+    return form
+
+
+def venue_version(app, venue_id):
+    with app.app_context():
+        return fyyur.db.session.get(fyyur.Venue, venue_id).version
+
+
+def test_unchanged_edit_writes_nothing(app, client, seed):
+    # NULL columns come back from the form as '' or False
+    venues, _ = seed(venues=1, artists=1, shows=0)
+    with app.app_context():
+        fyyur.Venue.query.filter_by(id=venues[0]).update({'seeking_talent': None, 'seeking_description': None})
+        fyyur.db.session.commit()
+    response = client.post('/venues/{}/edit'.format(venues[0]), data=edit_form(app, venues[0]))
+    assert response.status_code == 302
+    assert venue_version(app, venues[0]) == 1
+    # resubmitting the same form is not a conflict either
+    response = client.post('/venues/{}/edit'.format(venues[0]), data=edit_form(app, venues[0], version='1'))
+    assert response.status_code == 302
+
+
+def test_stale_edit_is_a_conflict(app, client, seed):
+    venues, _ = seed(venues=1, artists=1, shows=0)
+    form = edit_form(app, venues[0], name='Renamed')
+    assert client.post('/venues/{}/edit'.format(venues[0]), data=form).status_code == 302
+    assert venue_version(app, venues[0]) == 2
+    stale = client.post('/venues/{}/edit'.format(venues[0]), data=dict(form, name='Stale'))
+    assert stale.status_code == 409
+    assert b'changed by someone else' in stale.data
+    with app.app_context():
+        assert fyyur.db.session.get(fyyur.Venue, venues[0]).name == 'Renamed'
+        assert fyyur.facets.count(fyyur.Venue, 'genre', 'Rock n Roll') == 1
+
+
+def test_edit_moves_facet_counts(app, client, seed):
+    venues, _ = seed(venues=1, artists=1, shows=0)
+    form = edit_form(app, venues[0], genres=['Jazz'], city='Oakland')
+    assert client.post('/venues/{}/edit'.format(venues[0]), data=form).status_code == 302
+    with app.app_context():
+        assert fyyur.facets.count(fyyur.Venue, 'genre', 'Rock n Roll') == 0
+        assert fyyur.facets.count(fyyur.Venue, 'genre', 'Jazz') == 1
+        assert fyyur.facets.count(fyyur.Venue, 'city', 'Oakland') == 1
+
+
+def test_http_import_needs_the_api_token(make_app):
+    app = make_app(WTF_CSRF_ENABLED=True, IMPORT_API_TOKEN='s3cret')
+    client = app.test_client()
+    body = 'name,city,state,phone,genres\nThe Wild Sax Band,San Francisco,CA,432-325-5432,Jazz;Blues\n'
+    assert client.post('/artists/import', data=body, content_type='text/csv').status_code == 403
+    response = client.post('/artists/import', data=body, content_type='text/csv',
+                           headers={'Authorization': 'Bearer wrong'})
+    assert response.status_code == 403
+    response = client.post('/artists/import', data=body, content_type='text/csv',
+                           headers={'Authorization': 'Bearer s3cret'})
+    assert response.status_code == 200
+    assert response.get_json() == {'inserted': 1, 'errors': []}
+    with app.app_context():
+        assert fyyur.facets.count(fyyur.Artist, 'genre', 'Blues') == 1
+
+
+def test_http_import_is_off_without_a_token(client):
+    body = 'name,city,state,phone,genres\nThe Wild Sax Band,San Francisco,CA,432-325-5432,Jazz\n'
+    assert client.post('/artists/import', data=body, content_type='text/csv').status_code == 403
+
+
+def test_imported_shows_update_counters(app, seed):
+    venues, artists = seed(venues=1, artists=1, shows=0)
+    start_time = (datetime.now() + timedelta(days=5)).replace(microsecond=0)
+    rows = 'venue_id,artist_id,start_time\n{},{},{}\n'.format(venues[0], artists[0], start_time)
+    with app.app_context():
+        inserted, errors = fyyur.bulk_import('shows', io.StringIO(rows), 'csv')
+        assert (inserted, errors) == (1, [])
+        assert fyyur.db.session.get(fyyur.Venue, venues[0]).upcoming_shows_count == 1
+
+
+def test_create_artist(app, client):
+    response = client.post('/artists/create', data=dict(ARTIST_FORM, name='Guns N Petals'))
+    assert response.status_code == 302
+    with app.app_context():
+        artist = fyyur.Artist.query.one()
+        assert (artist.name, artist.phone, artist.genres) == ('Guns N Petals', '326-123-5000', ['Rock n Roll'])
+
+
+def test_imported_rows_need_every_required_column(app, seed):
+    # start_time has a default in the HTML form; a row without it is still an error
+    venues, artists = seed(venues=1, artists=1, shows=0)
+    rows = 'venue_id,artist_id\n{},{}\n'.format(venues[0], artists[0])
+    with app.app_context():
+        inserted, errors = fyyur.bulk_import('shows', io.StringIO(rows), 'csv')
+        assert inserted == 0
+        assert errors == [{'line': 2, 'errors': {'start_time': ['This field is required.']}}]
+        assert fyyur.Show.query.count() == 0
+
+
+def test_edit_without_a_version_is_rejected(app, client, seed):
+    venues, artists = seed(venues=1, artists=1, shows=0)
+    form = edit_form(app, venues[0], name='Renamed')
+    del form['version']
+    assert client.post('/venues/{}/edit'.format(venues[0]), data=form).status_code == 400
+    assert client.post('/artists/{}/edit'.format(artists[0]), data=dict(ARTIST_FORM)).status_code == 400
+    assert venue_version(app, venues[0]) == 1
@@ -0,0 +1,309 @@
+"""Resized, locally cached copies of remote venue and artist images.
+
+Templates call ``thumbnail_url(image_link, 'tile', 'webp')``; the URL carries
+a signed token for the remote address and the size preset, so the proxy only
+fetches links the app itself rendered. Tokens are signed with
+``THUMBNAIL_SIGNING_KEY`` (``SECRET_KEY`` when unset), which has to outlive
+the process for the URLs to stay valid.
+
+A request for a thumbnail that is not rendered yet is redirected to the
+original image and hands the link to the ``render_thumbnail`` background job
+(jobs.py), so the job workers must share ``THUMBNAIL_CACHE_DIR`` with the web
+processes. The job downloads the image (public hosts only, at most
+``THUMBNAIL_MAX_SOURCE_BYTES``) and renders every size preset as WebP and
+JPEG, named by the SHA-256 of the source bytes, so links to the same picture
+share files. A link is queued or retried at most once per
+``THUMBNAIL_RETRY_AFTER`` seconds; the last ``THUMBNAIL_RECENT_LINKS`` links
+are remembered for that. The directory is kept under
+``THUMBNAIL_CACHE_MAX_BYTES`` by dropping the least recently served files.
+Responses are immutable for a year: an edited link gets a new URL.
+
+``open_public`` does the fetching here and for the link checks. It resolves
+each host once, when connecting, and connects to the address it checked, so
+a DNS answer that changes between the check and the connection cannot reach
+a private address; every redirect hop is a new connection, checked the same
+way.
+
+Needs Pillow; without it ``thumbnail_url`` returns the original link.
+"""
+import hashlib
+import http.client
+import io
+import ipaddress
+import os
+import socket
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+
+from flask import abort, current_app, redirect, send_file, url_for
+from itsdangerous import BadSignature, URLSafeSerializer
+
+from jobs import task
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+FORMATS = {'webp': ('WEBP', 'image/webp'), 'jpg': ('JPEG', 'image/jpeg')}
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def public_address(host, port):
+    # One address of host if every address it resolves to is public, else None.
+    try:
+        addresses = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+    except (OSError, UnicodeError):
+        return None
+    if not addresses or not all(ipaddress.ip_address(address[4][0]).is_global for address in addresses):
+        return None
+    return addresses[0][4][0]
+
+
+def is_public_url(url):
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        return False
+    try:
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+    except ValueError:
+        return False
+    return public_address(parts.hostname, port) is not None
+
+
+def _connect_public(connection):
+    # The socket goes to the address that was checked, not to a second lookup.
+    address = public_address(connection.host, connection.port)
+    if address is None:
+        raise OSError('not a public address: {}'.format(connection.host))
+    return socket.create_connection((address, connection.port), connection.timeout, connection.source_address)
+
+
+class PublicHTTPConnection(http.client.HTTPConnection):
+
+    def connect(self):
+        self.sock = _connect_public(self)
+
+
+class PublicHTTPSConnection(http.client.HTTPSConnection):
+
+    def connect(self):
+        # SNI and certificate checks still use the host name
+        self.sock = self._context.wrap_socket(_connect_public(self), server_hostname=self.host)
+
+
+class PublicHTTPHandler(urllib.request.HTTPHandler):
+
+    def http_open(self, req):
+        return self.do_open(PublicHTTPConnection, req)
+
+
+class PublicHTTPSHandler(urllib.request.HTTPSHandler):
+
+    def https_open(self, req):
+        return self.do_open(PublicHTTPSConnection, req, context=self._context)
+
+
+class PublicRedirectHandler(urllib.request.HTTPRedirectHandler):
+    # Redirects stay on http(s); the connection to each hop checks its host.
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        if urllib.parse.urlsplit(newurl).scheme not in ('http', 'https'):
+            raise urllib.error.HTTPError(newurl, code, 'redirect to a non-http URL', headers, fp)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+# No proxies: the checked address must be the one connected to.
+_public_opener = urllib.request.build_opener(urllib.request.ProxyHandler({}), PublicHTTPHandler,
+                                             PublicHTTPSHandler, PublicRedirectHandler)
+
+
+def open_public(req, timeout):
+    """``urlopen`` for public hosts only, redirects included; raises OSError otherwise."""
+    if urllib.parse.urlsplit(req.full_url).scheme not in ('http', 'https'):
+        raise urllib.error.URLError('not an http(s) URL: {}'.format(req.full_url))
+    return _public_opener.open(req, timeout=timeout)
+
+
+@task
+def render_thumbnail(image_link):
+    current_app.extensions['thumbnails'].fetch_and_render(image_link)
+
+
+class Thumbnails(object):
+
+    def __init__(self, app=None):
+        self.enabled = Image is not None
+        self.serializer = None
+        self.total = None
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('THUMBNAIL_CACHE_DIR', os.path.join(app.instance_path, 'thumbnails'))
+        app.config.setdefault('THUMBNAIL_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+        app.config.setdefault('THUMBNAIL_MAX_SOURCE_BYTES', 10 * 1024 * 1024)
+        app.config.setdefault('THUMBNAIL_FETCH_TIMEOUT', 5)
+        app.config.setdefault('THUMBNAIL_RETRY_AFTER', 300)
+        app.config.setdefault('THUMBNAIL_RECENT_LINKS', 10000)
+        app.config.setdefault('THUMBNAIL_QUALITY', 80)
+        app.config.setdefault('THUMBNAIL_SIZES', {'tile': (600, 400), 'detail': (1200, 1000)})
+        app.config.setdefault('THUMBNAIL_SIGNING_KEY', None)
+        self.directory = app.config['THUMBNAIL_CACHE_DIR']
+        self.max_bytes = app.config['THUMBNAIL_CACHE_MAX_BYTES']
+        self.max_source_bytes = app.config['THUMBNAIL_MAX_SOURCE_BYTES']
+        self.timeout = app.config['THUMBNAIL_FETCH_TIMEOUT']
+        self.retry_after = app.config['THUMBNAIL_RETRY_AFTER']
+        self.recent_links = app.config['THUMBNAIL_RECENT_LINKS']
+        self.quality = app.config['THUMBNAIL_QUALITY']
+        self.sizes = app.config['THUMBNAIL_SIZES']
+        self.serializer = URLSafeSerializer(app.config['THUMBNAIL_SIGNING_KEY'] or app.config['SECRET_KEY'],
+                                            salt='thumbnail')
+        app.add_url_rule('/thumbnails/<size>/<token>.<any(webp, jpg):format>', 'thumbnail', self.serve)
+        app.jinja_env.globals['thumbnail_url'] = self.url
+        app.extensions['thumbnails'] = self
+
+    def url(self, image_link, size, format='jpg'):
+        if not image_link or Image is None:
+            return image_link
+        return url_for('thumbnail', size=size, token=self.serializer.dumps(image_link), format=format)
+
+    def serve(self, size, token, format):
+        if Image is None or size not in self.sizes:
+            abort(404)
+        try:
+            image_link = self.serializer.loads(token)
+        except BadSignature:
+            abort(404)
+        variant = '{}.{}'.format(size, format)
+        ref = self.ref(image_link)
+        try:
+            with open(ref) as f:
+                digest = f.read().strip()
+            path = self.path(digest, variant)
+            os.utime(ref)
+            os.utime(path)
+        except OSError:
+            # not rendered yet, or evicted since: the original will do meanwhile
+            self.render_later(image_link)
+            response = redirect(image_link)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        response = send_file(path, mimetype=FORMATS[format][1], max_age=31536000, etag=digest + '-' + variant)
+        response.headers['Cache-Control'] = IMMUTABLE
+        return response
+
+    def ref(self, image_link):
+        return os.path.join(self.directory, 'refs', hashlib.sha256(image_link.encode('utf-8')).hexdigest())
+
+    def path(self, digest, variant):
+        return os.path.join(self.directory, digest[:2], '{}-{}'.format(digest, variant))
+
+    def attempt(self, image_link):
+        # True at most once per THUMBNAIL_RETRY_AFTER for each of the last
+        # THUMBNAIL_RECENT_LINKS links.
+        now = time.monotonic()
+        with self._lock:
+            if now - self._recent.get(image_link, -self.retry_after) < self.retry_after:
+                return False
+            self._recent[image_link] = now
+            self._recent.move_to_end(image_link)
+            while len(self._recent) > self.recent_links:
+                self._recent.popitem(last=False)
+        return True
+
+    def render_later(self, image_link):
+        if self.attempt(image_link):
+            jobs = current_app.extensions['jobs']
+            jobs.enqueue('render_thumbnail', image_link=image_link)
+            jobs.db.session.commit()
+
+    def fetch_and_render(self, image_link):
+        # Every size and format is rendered from a single download; the source
+        # itself is not kept. Several web processes may have queued the same
+        # link, so one that is already rendered is left alone.
+        ref = self.ref(image_link)
+        try:
+            with open(ref) as f:
+                digest = f.read().strip()
+        except OSError:
+            digest = None
+        if digest and all(os.path.exists(self.path(digest, '{}.{}'.format(size, format)))
+                          for size in self.sizes for format in FORMATS):
+            return digest
+        data = self.fetch(image_link)
+        try:
+            if data is None:
+                raise ValueError('not an image')
+            digest = hashlib.sha256(data).hexdigest()
+            with Image.open(io.BytesIO(data)) as source:
+                source.load()
+                for size, box in self.sizes.items():
+                    image = source.copy()
+                    image.thumbnail(box)
+                    for format, (codec, _) in FORMATS.items():
+                        out = io.BytesIO()
+                        if format == 'jpg':
+                            mode = 'RGB'
+                        else:
+                            mode = image.mode if image.mode in ('RGB', 'RGBA') else 'RGBA'
+                        image.convert(mode).save(out, codec, quality=self.quality)
+                        self.write(self.path(digest, '{}.{}'.format(size, format)), out.getvalue())
+        except (OSError, ValueError, Image.DecompressionBombError):
+            return None
+        self.write(ref, digest.encode('ascii'))
+        return digest
+
+    def fetch(self, image_link):
+        req = urllib.request.Request(image_link, headers={'User-Agent': 'fyyur-thumbnails'})
+        try:
+            with open_public(req, self.timeout) as response:
+                if response.headers.get_content_maintype() != 'image':
+                    return None
+                data = response.read(self.max_source_bytes + 1)
+        except (OSError, ValueError):
+            return None
+        return data if len(data) <= self.max_source_bytes else None
+
+    def write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            if self.total is not None:
+                self.total += len(data)
+        if self.total is None or self.total > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        # Least recently served first; serve() touches the mtime of every hit.
+        with self._lock:
+            files = []
+            for root, _, names in os.walk(self.directory):
+                for name in names:
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in files)
+            target = self.max_bytes * 0.9
+            for _, size, path in sorted(files):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+            self.total = total
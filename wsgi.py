@@ -0,0 +1,8 @@
+"""Production WSGI entry point: ``gunicorn -c gunicorn.conf.py wsgi:app``.
+
+The one module that builds an app at import time.
+"""
+from app import create_app
+
+app = create_app()
+application = app